@@ -0,0 +1,258 @@
+#! /usr/bin/env python
+
+"""
+Alignment of pairs of words, with substitution costs from feature differences.
+
+The cost of substituting one segment for another is the total weight of the
+features on which they differ (a feature specified in only one of them
+differs), divided by the total weight of the features specified in either, so
+it is between 0 and 1. Inserting or deleting a segment costs a fixed gap
+cost. The costs of every pair of segments in the inventory are computed once,
+into a table.
+
+Distances are computed by dynamic programming over many pairs at once with
+NumPy. Only cells within a band around the diagonal are filled, and each row
+of the band is filled for every pair in one set of array operations:
+substitutions and deletions come from the row above, and insertions within
+the row are a running minimum along it.
+
+This module needs NumPy.
+"""
+
+import numpy
+
+DIAGONAL = 0
+UP = 1
+LEFT = 2
+
+class Aligner:
+    def __init__(self, inventory, weights=None, gap=1.0, band=2):
+        """
+        Create a new aligner and compute its table of substitution costs.
+
+        Arguments:
+        inventory : a dictionary from symbols to segments or phonemes, each of
+            which has a mapping from features to values called features
+        Optional arguments:
+        weights : a dictionary from features to weights; by default 1 each
+        gap : the cost of inserting or deleting a segment
+        band : how far from the diagonal to look, beyond the difference in
+            the lengths of the words
+        """
+        self.symbols = [None] + sorted(inventory)
+        self.gap = float(gap)
+        self.band = band
+        self._index = {s: i for i, s in enumerate(self.symbols) if i}
+        self._by_features = {}
+        features = [None]
+        for symbol in self.symbols[1:]:
+            bundle = dict(inventory[symbol].features)
+            features.append(bundle)
+            self._by_features.setdefault(frozenset(bundle.items()),
+                                         self._index[symbol])
+        weights = weights or {}
+        size = len(self.symbols)
+        # Index 0 is padding, and costs nothing
+        self.costs = numpy.zeros((size, size))
+        for i in range(1, size):
+            for j in range(i + 1, size):
+                a, b = features[i], features[j]
+                union = set(a) | set(b)
+                total = sum(weights.get(f, 1.0) for f in union)
+                differ = sum(weights.get(f, 1.0) for f in union
+                             if a.get(f) != b.get(f))
+                self.costs[i, j] = self.costs[j, i] = (differ / total
+                                                       if total else 0.0)
+
+    def cost(self, a, b):
+        """
+        Return the cost of substituting one symbol for another.
+
+        Arguments:
+        a : the first symbol
+        b : the second symbol
+        """
+        return self.costs[self._index[a], self._index[b]]
+
+    def _encode(self, word):
+        """Return a word, a string or a Segment of segments, as indices."""
+        if isinstance(word, str):
+            try: return [self._index[s] for s in word]
+            except KeyError as e:
+                raise ValueError('no symbol <%s> in the inventory' % e.args[0])
+        indices = []
+        for segment in word.segments:
+            key = frozenset(segment.features.items())
+            if not key in self._by_features:
+                raise ValueError('no segment %s in the inventory' %
+                                 dict(segment.features))
+            indices.append(self._by_features[key])
+        return indices
+
+    def _encode_all(self, words):
+        """
+        Encode words once, into a padded array of indices and their lengths.
+        """
+        encoded = [self._encode(word) for word in words]
+        lengths = numpy.array([len(w) for w in encoded], dtype=numpy.intp)
+        longest = int(lengths.max()) if len(encoded) else 0
+        padded = numpy.zeros((len(encoded), max(longest, 1)), dtype=numpy.intp)
+        for k, word in enumerate(encoded):
+            padded[k, :len(word)] = word
+        return padded, lengths
+
+    def _batch(self, words1, lengths1, words2, lengths2, traceback):
+        """
+        Align a batch of pairs of encoded words, given as padded arrays of
+        indices and arrays of lengths.
+
+        Return an array of distances and, if traceback is true, the array of
+        moves for each cell.
+        """
+        count = len(lengths1)
+        rows = int(lengths1.max()) if count else 0
+        columns = int(lengths2.max()) if count else 0
+        # Each pair has its own band, so its distance does not depend on the
+        # rest of the batch
+        bands = numpy.maximum(self.band, abs(lengths1 - lengths2))[:, None]
+        band = int(bands.max()) if count else 0
+        gap = self.gap
+        table = numpy.full((count, rows + 1, columns + 1), numpy.inf)
+        moves = None
+        if traceback:
+            moves = numpy.zeros((count, rows + 1, columns + 1),
+                                dtype=numpy.uint8)
+            moves[:, 0, 1:] = LEFT
+            moves[:, 1:, 0] = UP
+        edge = numpy.arange(columns + 1)
+        table[:, 0, :] = numpy.where(edge <= bands, edge * gap, numpy.inf)
+        edge = numpy.arange(rows + 1)
+        table[:, :, 0] = numpy.where(edge <= bands, edge * gap, numpy.inf)
+        for i in range(1, rows + 1):
+            low = max(1, i - band)
+            high = min(columns, i + band)
+            if low > high: continue
+            span = slice(low, high + 1)
+            outside = abs(numpy.arange(low, high + 1) - i) > bands
+            substitution = self.costs[words1[:, i - 1][:, None],
+                                      words2[:, low - 1:high]]
+            diagonal = table[:, i - 1, low - 1:high] + substitution
+            up = table[:, i - 1, span] + gap
+            best = numpy.minimum(diagonal, up)
+            best[outside] = numpy.inf
+            # An insertion extends the cell to the left, so the best cost at
+            # j is j * gap plus the running minimum of best[k] - k * gap,
+            # including the cell just before the band
+            steps = numpy.arange(low - 1, high + 1) * gap
+            start = table[:, i, low - 1:low]
+            shifted = numpy.concatenate((start, best), axis=1) - steps
+            running = numpy.minimum.accumulate(shifted, axis=1)
+            left = running[:, :-1] < shifted[:, 1:]
+            row = numpy.where(left, running[:, 1:] + steps[1:], best)
+            row[outside] = numpy.inf
+            table[:, i, span] = row
+            if traceback:
+                move = numpy.where(diagonal <= up, DIAGONAL, UP)
+                move[left] = LEFT
+                moves[:, i, span] = move
+        distances = table[numpy.arange(count), lengths1, lengths2]
+        return distances, moves
+
+    def _batches(self, words, first, second, batch_size):
+        """
+        Encode each word once, and yield batches of the pairs of words at
+        the given indices, sorted by length so that little is padding.
+
+        Each batch is the positions of its pairs and the arguments of _batch.
+        """
+        padded, lengths = self._encode_all(words)
+        order = numpy.lexsort((lengths[second], lengths[first]))
+        for start in range(0, len(order), batch_size):
+            chosen = order[start:start + batch_size]
+            i, j = first[chosen], second[chosen]
+            yield chosen, (padded[i], lengths[i], padded[j], lengths[j])
+
+    def _pairs(self, pairs):
+        """Return the words of some pairs, and the indices of each pair."""
+        words = [word for pair in pairs for word in pair]
+        first = numpy.arange(0, len(words), 2)
+        return words, first, first + 1
+
+    def distances(self, pairs, batch_size=4096):
+        """
+        Return an array of the alignment distance of every pair of words.
+
+        Arguments:
+        pairs : a list of pairs of words, each a string of symbols or a
+            Segment of segments
+        Optional arguments:
+        batch_size : the number of pairs aligned at once
+        """
+        words, first, second = self._pairs(pairs)
+        return self._distances(words, first, second, batch_size)
+
+    def _distances(self, words, first, second, batch_size):
+        result = numpy.empty(len(first))
+        for chosen, batch in self._batches(words, first, second, batch_size):
+            result[chosen] = self._batch(*batch, traceback=False)[0]
+        return result
+
+    def align(self, pairs, batch_size=1024):
+        """
+        Align every pair of words.
+
+        Return a list of tuples of a distance and an alignment, which is a
+        list of pairs of aligned symbols, with None for a gap.
+
+        Arguments:
+        pairs : a list of pairs of words, each a string of symbols or a
+            Segment of segments
+        Optional arguments:
+        batch_size : the number of pairs aligned at once
+        """
+        words, first, second = self._pairs(pairs)
+        result = [None] * len(first)
+        for chosen, batch in self._batches(words, first, second, batch_size):
+            words1, lengths1, words2, lengths2 = batch
+            distances, moves = self._batch(*batch, traceback=True)
+            for k, position in enumerate(chosen):
+                result[position] = (float(distances[k]), self._traceback(
+                    moves[k], words1[k, :lengths1[k]],
+                    words2[k, :lengths2[k]]))
+        return result
+
+    def _traceback(self, moves, a, b):
+        i, j = len(a), len(b)
+        steps = []
+        while i or j:
+            move = moves[i, j]
+            if move == DIAGONAL:
+                steps.append((self.symbols[a[i - 1]], self.symbols[b[j - 1]]))
+                i -= 1
+                j -= 1
+            elif move == UP:
+                steps.append((self.symbols[a[i - 1]], None))
+                i -= 1
+            else:
+                steps.append((None, self.symbols[b[j - 1]]))
+                j -= 1
+        steps.reverse()
+        return steps
+
+    def all_pairs(self, words, batch_size=4096):
+        """
+        Return a square array of the distance between every two words.
+
+        Arguments:
+        words : a list of words, each a string of symbols or a Segment of
+            segments
+        Optional arguments:
+        batch_size : the number of pairs aligned at once
+        """
+        words = list(words)
+        first, second = numpy.triu_indices(len(words), 1)
+        distances = self._distances(words, first, second, batch_size)
+        result = numpy.zeros((len(words), len(words)))
+        result[first, second] = distances
+        result[second, first] = distances
+        return result
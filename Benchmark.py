@@ -0,0 +1,411 @@
+#! /usr/bin/env python
+
+"""
+Benchmarks of the hot paths, on synthetic inventories, implications, feature
+geometries, and grammars of configurable size.
+
+Run 'python Benchmark.py' to run every benchmark and write the results as
+JSON to benchmark.json, or see 'python Benchmark.py --help'. Every generator
+is seeded, so two runs with the same arguments measure the same work, and the
+output of runs of different versions can be compared benchmark by benchmark.
+"""
+
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import math
+import platform
+import random
+import string
+import sys
+import time
+
+import Constraints
+import pyre
+from FeatureGeometry import FeatureGeometry
+from Segment import Alphabet
+
+# Generators
+
+def feature_names(count):
+    return ['f%d' % i for i in range(count)]
+
+def features_for(size, minimum=40):
+    """
+    Return a number of features large enough that a collection of size random
+    implications or constraints over them is rarely redundant, so that it
+    really reaches its size.
+
+    Arguments:
+    size : the size of the collection
+    Optional arguments:
+    minimum : the smallest number of features to return
+    """
+    return max(minimum, int(math.ceil(math.sqrt(8 * size))))
+
+def random_phoneme(rng, features, size):
+    """
+    Return a phoneme with some random signed features.
+
+    Arguments:
+    rng : a random.Random
+    features : a list of feature names to choose from
+    size : the number of features in the phoneme
+    """
+    return pyre.Phoneme({f: rng.random() < 0.5
+                         for f in rng.sample(features, size)})
+
+def inventory(size, features=20, specified=8, seed=0):
+    """
+    Return a dictionary from symbols to random phonemes.
+
+    Arguments:
+    size : the number of symbols
+    Optional arguments:
+    features : the number of features to choose from
+    specified : the number of features in each phoneme
+    seed : the random seed
+    """
+    rng = random.Random(seed)
+    names = feature_names(features)
+    return {'s%d' % i: random_phoneme(rng, names, specified)
+            for i in range(size)}
+
+def implications(size, features=40, seed=0):
+    """
+    Return a list of random implications as pairs of phonemes.
+
+    Arguments:
+    size : the number of implications
+    Optional arguments:
+    features : the number of features to choose from
+    seed : the random seed
+    """
+    return list(itertools.islice(_implications(features, seed), size))
+
+def _implications(features, seed):
+    rng = random.Random(seed)
+    names = feature_names(features)
+    while True:
+        chosen = rng.sample(names, rng.randint(2, 4))
+        split = rng.randint(1, len(chosen) - 1)
+        yield (pyre.Phoneme({f: rng.random() < 0.5 for f in chosen[:split]}),
+               pyre.Phoneme({f: rng.random() < 0.5 for f in chosen[split:]}))
+
+def feature_set(features):
+    """
+    Return a Constraints.FeatureSet of binary features.
+
+    Arguments:
+    features : the number of features
+    """
+    featureset = Constraints.FeatureSet()
+    for name in feature_names(features):
+        featureset.update(name, Constraints.Feature(['+', '-']))
+    return featureset
+
+def constraints(size, featureset, features, seed=0):
+    """
+    Return a list of random Constraints.Constraint.
+
+    Arguments:
+    size : the number of constraints
+    featureset : the FeatureSet of the features
+    features : the number of features in the feature set
+    Optional arguments:
+    seed : the random seed
+    """
+    rng = random.Random(seed)
+    names = feature_names(features)
+    # Two constraints on the same pair of features may conflict, so every
+    # constraint gets a pair of its own
+    pairs = list(itertools.combinations(names, 2))
+    if size > len(pairs):
+        raise ValueError('%d features only make %d constraints' %
+                         (features, len(pairs)))
+    result = []
+    for feature1, feature2 in rng.sample(pairs, size):
+        if rng.random() < 0.5: feature1, feature2 = feature2, feature1
+        result.append(Constraints.Constraint(feature1, '+', feature2, '+',
+                                             rng.random() < 0.5,
+                                             rng.random() < 0.5, featureset))
+    return result
+
+def geometry(depth, branching=2):
+    """
+    Return a FeatureGeometry whose spine is a chain of the given depth.
+
+    Every node on the spine also has leaves, so that the tree is not a list.
+
+    Arguments:
+    depth : the number of nodes on the spine
+    Optional arguments:
+    branching : the number of leaves on each node of the spine
+    """
+    tree = FeatureGeometry()
+    tree.add('n0')
+    for i in range(1, depth):
+        tree.add('n%d' % i, parent='n%d' % (i - 1))
+        for j in range(branching):
+            tree.add('n%d.%d' % (i, j), parent='n%d' % (i - 1))
+    return tree
+
+def alphabet(size, seed=0):
+    """
+    Return an Alphabet of single-character symbols for random phonemes.
+
+    Arguments:
+    size : the number of symbols, at most 62
+    Optional arguments:
+    seed : the random seed
+    """
+    symbols = (string.ascii_letters + string.digits)[:size]
+    phonemes = list(inventory(size, seed=seed).values())
+    return Alphabet(dict(zip(symbols, phonemes)))
+
+def words(count, alphabet, length=8, seed=0):
+    """
+    Return a list of random words.
+
+    Arguments:
+    count : the number of words
+    alphabet : the Alphabet to take symbols from
+    Optional arguments:
+    length : the number of symbols in each word
+    seed : the random seed
+    """
+    rng = random.Random(seed)
+    symbols = sorted(alphabet.symbols)
+    return [''.join(rng.choice(symbols) for i in range(length))
+            for j in range(count)]
+
+def grammar(lines, features=30, seed=0):
+    """
+    Return a list of REPL lines defining phonemes and implications.
+
+    Arguments:
+    lines : the number of lines
+    Optional arguments:
+    features : the number of features to choose from
+    seed : the random seed
+    """
+    rng = random.Random(seed)
+    names = feature_names(features)
+    def signed(count):
+        return ' '.join('%s%s' % (rng.choice('+-'), f)
+                        for f in rng.sample(names, count))
+    script = []
+    for i in range(lines):
+        kind = rng.random()
+        if kind < 0.6:
+            script.append('p%d p%d = %s' % (rng.randrange(lines),
+                                            rng.randrange(lines), signed(3)))
+        elif kind < 0.8:
+            script.append('%s : p%d' % (signed(2), rng.randrange(lines)))
+        else:
+            script.append('%s => %s' % (signed(1), signed(1)))
+    return script
+
+# Measurement
+
+def measure(function, operations, repeat=3, setup=None):
+    """
+    Return the best time per operation, in seconds, over several runs.
+
+    Arguments:
+    function : a function that performs the operations
+    operations : the number of operations performed by one call
+    Optional arguments:
+    repeat : the number of runs
+    setup : an untimed function whose result is passed to the function
+    """
+    best = None
+    for i in range(repeat):
+        if setup is None: arguments = ()
+        else: arguments = (setup(),)
+        start = time.perf_counter()
+        function(*arguments)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best: best = elapsed
+    return best / operations
+
+@contextlib.contextmanager
+def session(symbols={}, rules={}):
+    """
+    Temporarily replace pyre's symbols and constraints, and silence output.
+
+    Optional arguments:
+    symbols : the symbols to use
+    rules : the constraints to use
+    """
+    saved = dict(pyre.symbols), dict(pyre.constraints)
+    pyre.symbols.clear()
+    pyre.symbols.update(symbols)
+    pyre.constraints.clear()
+    pyre.constraints.update(rules)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()), \
+             contextlib.redirect_stderr(io.StringIO()):
+            yield
+    finally:
+        pyre.symbols.clear()
+        pyre.symbols.update(saved[0])
+        pyre.constraints.clear()
+        pyre.constraints.update(saved[1])
+
+# Benchmarks
+#
+# Each benchmark takes a size and returns the seconds per operation, or a
+# tuple of the seconds per operation and the size that the collection it
+# measures really reached, if that can differ from the size asked for.
+
+def bench_phoneme_le(size):
+    phonemes = list(inventory(size).values())
+    pairs = list(zip(phonemes, reversed(phonemes)))
+    return measure(lambda: [a <= b for a, b in pairs], len(pairs))
+
+def bench_phoneme_contradicts(size):
+    phonemes = list(inventory(size).values())
+    pairs = list(zip(phonemes, reversed(phonemes)))
+    return measure(lambda: [a.contradicts(b) for a, b in pairs], len(pairs))
+
+def _prefilled(size, features):
+    """
+    Return a dictionary of about size constraints, made by adding random
+    implications until that many are left after merging and pruning.
+    """
+    with session():
+        attempts = 0
+        for key, value in _implications(features, seed=1):
+            if len(pyre.constraints) >= size or attempts >= 10 * size: break
+            pyre.add_constraint(key, value)
+            attempts += 1
+        return dict(pyre.constraints)
+
+def bench_add_constraint(size, operations=100):
+    """Add a few implications to a session that already has size of them."""
+    features = features_for(size)
+    existing = _prefilled(size, features)
+    new = implications(operations, features, seed=2)
+    def setup():
+        return ({k.copy(): v.copy() for k, v in existing.items()},
+                [(k.copy(), v.copy()) for k, v in new])
+    def run(state):
+        rules, pairs = state
+        with session(rules=rules):
+            for key, value in pairs:
+                pyre.add_constraint(key, value)
+    return measure(run, operations, setup=setup), len(existing)
+
+def bench_follows_constraints(size, operations=100):
+    """Check phonemes against a session with size implications."""
+    features = features_for(size)
+    existing = _prefilled(size, features)
+    phonemes = list(inventory(operations, features=features).values())
+    def run():
+        with session(rules=existing):
+            for phoneme in phonemes:
+                phoneme.copy().follows_constraints()
+    return measure(run, operations), len(existing)
+
+def bench_constraint_set_add(size, operations=100):
+    """Add a few constraints to a ConstraintSet that already has size."""
+    features = features_for(size + operations)
+    featureset = feature_set(features)
+    existing = constraints(size, featureset, features, seed=1)
+    new = constraints(operations, featureset, features, seed=2)
+    base = Constraints.ConstraintSet()
+    for constraint in existing:
+        base.overwrite(constraint)
+    def setup():
+        constraint_set = Constraints.ConstraintSet()
+        constraint_set._constraints = set(base._constraints)
+        return constraint_set
+    def run(constraint_set):
+        for constraint in new:
+            constraint_set.overwrite(constraint)
+    return measure(run, operations, setup=setup), len(base._constraints)
+
+def bench_is_ancestor(size):
+    tree = geometry(size)
+    leaf = 'n%d' % (size - 1)
+    return measure(lambda: [tree.is_ancestor('n0', leaf) for i in range(100)],
+                   100)
+
+def bench_alphabet_parse(size):
+    letters = alphabet(40)
+    lexicon = words(size, letters)
+    return measure(lambda: [letters.parse(w) for w in lexicon], size)
+
+def bench_alphabet_symbolize(size):
+    letters = alphabet(40)
+    parsed = [letters.parse(w) for w in words(size, letters)]
+    return measure(lambda: [letters.symbolize(p) for p in parsed], size)
+
+def bench_parser(size):
+    """Parse size lines of a grammar into an empty session."""
+    script = grammar(size)
+    def run():
+        with session():
+            for line in script:
+                pyre.parser.parse(line)
+    return measure(run, size, repeat=1)
+
+benchmarks = [
+    ('Phoneme.__le__', bench_phoneme_le, [1000, 10000]),
+    ('Phoneme.contradicts', bench_phoneme_contradicts, [1000, 10000]),
+    ('add_constraint', bench_add_constraint, [10, 100, 1000]),
+    ('follows_constraints', bench_follows_constraints, [10, 100, 1000]),
+    ('ConstraintSet.add', bench_constraint_set_add,
+     [100, 1000, 10000, 100000]),
+    ('FeatureGeometry.is_ancestor', bench_is_ancestor, [10, 100, 1000]),
+    ('Alphabet.parse', bench_alphabet_parse, [1000, 10000]),
+    ('Alphabet.symbolize', bench_alphabet_symbolize, [1000, 10000]),
+    ('parser', bench_parser, [100, 1000]),
+]
+
+def run(selected=None, scale=1.0):
+    """
+    Run benchmarks and return a list of results as dictionaries.
+
+    Optional arguments:
+    selected : a list of substrings; only matching benchmarks are run
+    scale : a factor to multiply every size by
+    """
+    results = []
+    for name, function, sizes in benchmarks:
+        if selected and not any(s in name for s in selected): continue
+        for size in sizes:
+            size = max(1, int(size * scale))
+            seconds = function(size)
+            if isinstance(seconds, tuple): seconds, reached = seconds
+            else: reached = size
+            results.append({'name': name, 'size': reached, 'requested': size,
+                            'seconds': seconds,
+                            'per_second': 1 / seconds if seconds else None})
+            sys.stderr.write('%-28s %8d %12.3f us %14.1f/s\n' %
+                             (name, reached, seconds * 1e6,
+                              1 / seconds if seconds else 0))
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark pyre.')
+    parser.add_argument('benchmarks', nargs='*',
+                        help='run only benchmarks whose names contain these')
+    parser.add_argument('--output', default='benchmark.json',
+                        help='the JSON file to write (default: %(default)s)')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiply every size by this')
+    args = parser.parse_args(argv)
+    results = run(args.benchmarks, args.scale)
+    with open(args.output, 'w') as f:
+        json.dump({'python': platform.python_version(),
+                   'platform': platform.platform(),
+                   'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'results': results}, f, indent=1)
+        f.write('\n')
+
+if __name__ == '__main__':
+    main()
@@ -26,6 +26,9 @@ A Constrant has:
 A Constraint implements:
     conflicts(Constraint) :
         Return whether this constraint conflicts with the given constraint.
+    allows(bundle dict(String, String)) :
+        Return whether the given mapping from features to values satisfies
+        this constraint. An unspecified feature has no value.
 
 A ConstraintSet has:
     constraints set(Constraint) :
@@ -43,10 +46,22 @@ A ConstraintSet implements:
     discard(constraint Constraint) :
         Discard the given constraint, without raising an error if it is not
         present.
-    allows(phoneme Phoneme) :
-        Return whether the given phoneme violates any constraints.
+    allows(bundle dict(String, String)) :
+        Return whether the given mapping from features to values satisfies
+        every constraint.
+
+A ConstraintError is raised when a constraint is added to a ConstraintSet
+that it conflicts with. Its constraints are the existing constraint and the
+new one.
 """
 
+from FeatureRegistry import registry
+
+class ConstraintError(ValueError):
+    def __init__(self, message, constraints=()):
+        ValueError.__init__(self, message)
+        self.constraints = tuple(constraints)
+
 class Feature:
     def __init__(self, values=set()):
         self._values = set(values)
@@ -68,6 +83,9 @@ class Feature:
         self._values.update(values)
         return self
 
+    def __iter__(self):
+        return iter(sorted(self._values))
+
     def contains(self, value):
         return value in self._values
 
@@ -88,10 +106,14 @@ class FeatureSet:
             raise TypeError('key must be a string')
         return self._features[key]
 
+    def __iter__(self):
+        return iter(sorted(self._features))
+
     def contains(self, feature):
         return feature in self._features
 
     def update(self, key, value):
+        registry.intern(key, value)
         self._features.update({key: value})
         return self
 
@@ -105,7 +127,7 @@ class Constraint:
         if not featureset.contains(feature2):
             raise KeyError('no feature [%s] found' % feature2)
         if feature1 == feature2:
-            raise StandardError('a feature cannot imply itself')
+            raise ValueError('a feature cannot imply itself')
         if not featureset[feature1].contains(value1):
             raise KeyError('[%s] is not a value in [%s]' %
                                 (value1, feature1))
@@ -127,6 +149,10 @@ class Constraint:
             self.boolean2 = boolean2
             self.feature2 = feature2
             self.value2 = value2
+        self._bits1 = registry.code(self.feature1, self.value1)
+        self._mask1 = registry.field(self.feature1).mask
+        self._bits2 = registry.code(self.feature2, self.value2)
+        self._mask2 = registry.field(self.feature2).mask
 
     def __str__(self):
         if self.boolean1: s = '( '
@@ -151,10 +177,10 @@ class Constraint:
                 hash(self.boolean2) ^ hash(self.feature2) ^ hash(self.value2))
 
     def conflicts(self, other):
-        if ((self.feature1 == other.feature1) and
-            (self.feature2 == other.feature2)):
-            same_value1 = self.value1 == other.value1
-            same_value2 = self.value2 == other.value2
+        if ((self._mask1 == other._mask1) and
+            (self._mask2 == other._mask2)):
+            same_value1 = self._bits1 == other._bits1
+            same_value2 = self._bits2 == other._bits2
             same_boolean1 = self.boolean1 == other.boolean1
             same_boolean2 = self.boolean2 == other.boolean2
             same1 = same_value1 == same_boolean1
@@ -164,6 +190,20 @@ class Constraint:
         else:
             return False
 
+    def allows(self, bundle):
+        return self.allows_bits(registry.pack(bundle)[0])
+
+    def allows_bits(self, bits):
+        """
+        Return whether a bundle packed by the shared registry is allowed.
+
+        Arguments:
+        bits : the bits of the bundle
+        """
+        if (bits & self._mask1 == self._bits1) != self.boolean1:
+            return True
+        return (bits & self._mask2 == self._bits2) == self.boolean2
+
 class ConstraintSet:
     def __init__(self, constraints=set()):
         self._constraints = set([])
@@ -180,7 +220,8 @@ class ConstraintSet:
         for c in self._constraints.copy():
             if c.conflicts(new):
                 if raise_error:
-                    raise StandardError('%s violates %s' % (c, new))
+                    raise ConstraintError('%s violates %s' % (c, new),
+                                          (c, new))
                 self.discard(c)
                 break
         self._constraints.add(new)
@@ -190,16 +231,13 @@ class ConstraintSet:
     def discard(self, constraint):
         self._constraints.discard(constraint)
 
-    def allows(self, phoneme):
+    def allows(self, bundle):
+        return self.allows_bits(registry.pack(bundle)[0])
+
+    def allows_bits(self, bits):
         for constraint in self._constraints:
-            if self.contradicts(constraints[constraint]):
-                sys.stderr.write('Error: the phoneme %s violates that '
-                                 'constraint!\n' % self)
+            if not constraint.allows_bits(bits):
                 return False
-            else:
-                for feature in constraints[constraint].features:
-                    self.features.update(
-                        {feature: constraints[constraint][feature]})
         return True
 
 universal_constraints = ConstraintSet()
@@ -1,8 +1,11 @@
 #! /usr/bin/env python
 
+from FeatureRegistry import registry
+
 class FeatureGeometry:
     def __init__(self):
         self._geometry = {}
+        self._legal = None
 
     def __repr__(self):
         return str(self)
@@ -27,6 +30,8 @@ class FeatureGeometry:
         parent : the name of the parent feature, if it already exist
         children : the set of the feature's children, if they already exist
         """
+        self._legal = None
+        registry.intern(name, values)
         if name in self._geometry:
             self._geometry[name].values = set(values)
         else:
@@ -52,6 +57,39 @@ class FeatureGeometry:
             self._geometry[node].children.add(self._geometry[child])
         return True
 
+    def legal(self):
+        """
+        Return the set of every legal (feature, value) pair.
+
+        The set is compiled once and kept until a feature is added or changed,
+        so validating a feature costs a single set lookup.
+        """
+        if self._legal is None:
+            self._legal = frozenset((name, value)
+                                    for name, node in self._geometry.items()
+                                    for value in node.values)
+        return self._legal
+
+    def pack(self, bundle):
+        """
+        Pack a mapping from features to values into the shared registry's
+        integers, after checking that every feature and value is legal.
+
+        Return a tuple of the bits and the mask.
+
+        Arguments:
+        bundle : the mapping from features to values
+        """
+        for item in bundle.items():
+            if not item in self.legal():
+                raise ValueError("Illegal feature or value [%s %s]" % item)
+        return registry.pack(bundle)
+
+    def values(self):
+        """Return a dictionary from every feature to its set of values."""
+        return {name: frozenset(node.values)
+                for name, node in self._geometry.items()}
+
     def parent(self, node):
         return self._geometry[node].parent
 
@@ -0,0 +1,188 @@
+#! /usr/bin/env python
+
+"""
+A registry that interns features and their values as small integers.
+
+Each feature is given a fixed-width field of bits, and each of its values a
+nonzero code in that field; 0 means the feature is unspecified. A bundle of
+features is then one integer, the bits, with each specified feature's code in
+its field. Its mask is the integer with every bit of every specified field
+set. With bits and masks, the usual comparisons are integer operations:
+    a is a subset of b : b.bits & a.mask == a.bits
+    a contradicts b : a.bits & m != b.bits & m, where m = a.mask & b.mask
+    b overwrites a : (a.bits & ~b.mask) | b.bits
+
+A field has room for more values than its feature starts with, so that values
+can be added later. Adding more values than a field has room for is an error.
+
+FeatureGeometry, Constraints, and pyre all intern their features in the
+shared registry in this module, so a feature has the same field everywhere.
+Interning is guarded by a lock, so threads sharing the registry never give two
+fields the same bits.
+"""
+
+import threading
+
+# The signs of binary features, as values
+PLUS = '+'
+MINUS = '-'
+
+class _Field:
+    __slots__ = ('name', 'shift', 'width', 'mask', 'values', 'codes')
+
+    def __init__(self, name, shift, width):
+        self.name = name
+        self.shift = shift
+        self.width = width
+        self.mask = ((1 << width) - 1) << shift
+        self.values = [None]
+        self.codes = {}
+
+    def __repr__(self):
+        return '_Field(%s, %d, %d, %s)' % (self.name, self.shift, self.width,
+                                          self.values[1:])
+
+class FeatureRegistry:
+    def __init__(self):
+        self._fields = {}
+        self._by_shift = {}
+        self._width = 0
+        self._lock = threading.Lock()
+
+    def __contains__(self, name):
+        return name in self._fields
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __repr__(self):
+        return 'FeatureRegistry(%s)' % sorted(self._fields.values(),
+                                               key=lambda f: f.shift)
+
+    def width(self):
+        """Return the number of bits used by every field together."""
+        return self._width
+
+    def intern(self, name, values=(PLUS, MINUS)):
+        """
+        Intern a feature and its values, if they are not already interned.
+
+        Return the feature's field.
+
+        Arguments:
+        name : the name of the feature
+        Optional arguments:
+        values : an iterable of the feature's values
+        """
+        values = [v for v in values]
+        with self._lock:
+            field = self._fields.get(name)
+            if field is None:
+                width = max(len(values), 2).bit_length() + 1
+                field = _Field(name, self._width, width)
+                self._width += width
+                self._by_shift[field.shift] = field
+                self._fields[name] = field
+            for value in values:
+                if not value in field.codes:
+                    if len(field.values) >> field.width:
+                        raise ValueError('no room for another value of [%s]'
+                                         % name)
+                    # The code is set last, so that a reader who finds it
+                    # also finds its value
+                    field.values.append(value)
+                    field.codes[value] = len(field.values) - 1
+        return field
+
+    def field(self, name):
+        """
+        Return the field of a feature.
+
+        Arguments:
+        name : the name of the feature
+        """
+        return self._fields[name]
+
+    def code(self, name, value):
+        """
+        Return the bits of a single feature with a value, interning both.
+
+        Arguments:
+        name : the name of the feature
+        value : the value
+        """
+        field = self._fields.get(name)
+        if field is None or not value in field.codes:
+            field = self.intern(name, (value,))
+        return field.codes[value] << field.shift
+
+    def pack(self, bundle):
+        """
+        Pack a mapping from features to values, interning any new ones.
+
+        Return a tuple of the bits and the mask.
+
+        Arguments:
+        bundle : the mapping from features to values
+        """
+        bits = 0
+        mask = 0
+        fields = self._fields
+        for name, value in bundle.items():
+            field = fields.get(name)
+            if field is None or not value in field.codes:
+                field = self.intern(name, (value,))
+            bits |= field.codes[value] << field.shift
+            mask |= field.mask
+        return bits, mask
+
+    def pack_signs(self, features):
+        """
+        Pack a mapping from binary features to Booleans, which stand for the
+        values PLUS and MINUS.
+
+        Return a tuple of the bits and the mask.
+
+        Arguments:
+        features : the mapping from features to Booleans
+        """
+        return self.pack({f: PLUS if s else MINUS
+                          for f, s in features.items()})
+
+    def fields(self, mask):
+        """
+        Yield the field of every feature in a mask.
+
+        Arguments:
+        mask : the mask
+        """
+        by_shift = self._by_shift
+        while mask:
+            field = by_shift[(mask & -mask).bit_length() - 1]
+            mask &= ~field.mask
+            yield field
+
+    def value(self, bits, name):
+        """
+        Return the value of a feature in some bits, or None if unspecified.
+
+        Arguments:
+        bits : the bits
+        name : the name of the feature
+        """
+        field = self._fields.get(name)
+        if field is None: return None
+        return field.values[(bits & field.mask) >> field.shift]
+
+    def unpack(self, bits, mask):
+        """
+        Return a dictionary from features to values for some bits.
+
+        Arguments:
+        bits : the bits
+        mask : the mask of the bits
+        """
+        return {f.name: f.values[(bits & f.mask) >> f.shift]
+                for f in self.fields(mask)}
+
+registry = FeatureRegistry()
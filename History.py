@@ -0,0 +1,160 @@
+#! /usr/bin/env python
+
+"""
+An undo log for dictionaries and attributes.
+
+Every change made through a History is recorded as the old value it replaced,
+but only while at least one checkpoint exists, so a session that never
+checkpoints pays for nothing but a test per change. Taking a checkpoint just
+remembers the length of the log. Rolling back pops the log back to that
+length, restoring each old value, so it costs time proportional to the number
+of changes since the checkpoint.
+"""
+
+_missing = object()
+
+class History:
+    def __init__(self):
+        self._log = []
+        self._checkpoints = {}
+        self._count = 0
+
+    def __contains__(self, name):
+        return name in self._checkpoints
+
+    def checkpoints(self):
+        """Return the names of the checkpoints, oldest first."""
+        return sorted(self._checkpoints, key=self._checkpoints.get)
+
+    def setitem(self, mapping, key, value):
+        """
+        Set a key in a mapping, recording its old value.
+
+        Arguments:
+        mapping : the dictionary to change
+        key : the key to set
+        value : the new value of the key
+        """
+        if self._checkpoints:
+            self._log.append((mapping, key, mapping.get(key, _missing), True))
+        mapping[key] = value
+
+    def delitem(self, mapping, key):
+        """
+        Delete a key from a mapping, recording its old value.
+
+        Arguments:
+        mapping : the dictionary to change
+        key : the key to delete
+        """
+        if self._checkpoints:
+            self._log.append((mapping, key, mapping[key], True))
+        del mapping[key]
+
+    def replace(self, mapping, items):
+        """
+        Replace the whole contents of a mapping, recording the old contents.
+
+        Arguments:
+        mapping : the dictionary to change
+        items : a dictionary of the new contents
+        """
+        for key in [k for k in mapping if k not in items]:
+            self.delitem(mapping, key)
+        for key, value in items.items():
+            self.setitem(mapping, key, value)
+
+    def setattr(self, obj, name, value):
+        """
+        Set an attribute of an object, recording its old value.
+
+        Arguments:
+        obj : the object to change
+        name : the name of the attribute
+        value : the new value of the attribute
+        """
+        if self._checkpoints:
+            self._log.append((obj, name, getattr(obj, name, _missing), False))
+        setattr(obj, name, value)
+
+    def checkpoint(self, name=None):
+        """
+        Mark the current state so that it can be rolled back to.
+
+        Return the name of the checkpoint.
+
+        Optional arguments:
+        name : the name of the checkpoint; by default, the next number
+        """
+        if name is None:
+            self._count += 1
+            name = str(self._count)
+        self._checkpoints.pop(name, None)
+        self._checkpoints[name] = len(self._log)
+        return name
+
+    def _position(self, name):
+        if not self._checkpoints:
+            raise KeyError('no checkpoints')
+        if name is None: name = self.checkpoints()[-1]
+        if not name in self._checkpoints:
+            raise KeyError('no checkpoint %s' % name)
+        return name, self._checkpoints[name]
+
+    def rollback(self, name=None):
+        """
+        Undo every change made since a checkpoint.
+
+        Later checkpoints are discarded; the checkpoint itself is kept, so it
+        can be rolled back to again.
+
+        Optional arguments:
+        name : the name of the checkpoint; by default, the latest one
+        """
+        name, position = self._position(name)
+        log = self._log
+        while len(log) > position:
+            target, key, old, item = log.pop()
+            if item:
+                if old is _missing: target.pop(key, None)
+                else: target[key] = old
+            elif old is _missing: delattr(target, key)
+            else: setattr(target, key, old)
+        names = self.checkpoints()
+        for later in names[names.index(name) + 1:]:
+            del self._checkpoints[later]
+        return name
+
+    def discard(self, name):
+        """
+        Forget a checkpoint. The log is cleared once none are left.
+
+        Arguments:
+        name : the name of the checkpoint
+        """
+        del self._checkpoints[name]
+        if not self._checkpoints: del self._log[:]
+
+    def originals(self, name=None):
+        """
+        Return the values that have changed since a checkpoint as of that
+        checkpoint.
+
+        Return two dictionaries. The first maps (id(mapping), key) to
+        (mapping, key, old value) for changed keys, and the second maps
+        (id(object), name) to (object, name, old value) for changed
+        attributes. A key or attribute that did not exist has the old value
+        History.missing.
+
+        Optional arguments:
+        name : the name of the checkpoint; by default, the latest one
+        """
+        name, position = self._position(name)
+        items = {}
+        attributes = {}
+        for target, key, old, item in reversed(self._log[position:]):
+            if item: items[id(target), key] = (target, key, old)
+            else: attributes[id(target), key] = (target, key, old)
+        return items, attributes
+
+    missing = _missing
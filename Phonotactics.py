@@ -0,0 +1,290 @@
+#! /usr/bin/env python
+
+"""
+Phonotactic statistics: counts of n-grams of segments and of natural classes
+over a lexicon, kept up to date as words change.
+
+Words are strings parsed with an Alphabet. Every word is padded with a word
+boundary, BOUNDARY, at each end, so n-grams record word-initial and word-final
+contexts. Counts for every order from 1 to n are kept in flat arrays indexed
+by the n-gram's segments as digits, so a lexicon of any size costs the same
+memory. When a sound change alters some words, update() subtracts the old
+words' n-grams and adds the new ones', so the cost depends only on the words
+that changed.
+
+The arrays have (number of symbols + 1) ** n cells for segment n-grams, so n
+should stay small for large alphabets.
+"""
+
+import math
+from array import array
+from itertools import product
+
+BOUNDARY = '#'
+
+class Ngrams:
+    def __init__(self, alphabet, n=2, classes=None):
+        """
+        Create empty counts.
+
+        Arguments:
+        alphabet : the Alphabet of the words
+        Optional arguments:
+        n : the longest n-grams to count
+        classes : a dictionary from names of natural classes to phonemes; a
+            segment is in a class if it has all the class's features
+        """
+        self.alphabet = alphabet
+        self.n = n
+        self.symbols = [BOUNDARY] + sorted(alphabet.symbols)
+        # Words are parsed into phonemes, so symbols for the same phoneme are
+        # counted as the first of them
+        self._phonemes = {}
+        for i, symbol in enumerate(self.symbols[1:], 1):
+            self._phonemes.setdefault(alphabet[symbol], i)
+        self.classes = sorted(classes or {})
+        # The classes of each segment, with the boundary in a class of its own
+        self._members = [(0,)]
+        for symbol in self.symbols[1:]:
+            phoneme = alphabet[symbol]
+            self._members.append(tuple(
+                i for i, name in enumerate(self.classes, 1)
+                if classes[name] <= phoneme))
+        self._index = {s: i for i, s in enumerate(self.symbols)}
+        self._class_index = {name: i for i, name in enumerate(self.classes, 1)}
+        self._class_index[BOUNDARY] = 0
+        self.words = 0
+        self._totals = [0] * (n + 1)
+        self.segments = [array('q', bytes(8 * len(self.symbols) ** k))
+                         for k in range(n + 1)]
+        self.natural = [array('q', bytes(8 * (len(self.classes) + 1) ** k))
+                        for k in range(n + 1)]
+
+    def _indices(self, word):
+        """Return a word's segments as indices, padded with boundaries."""
+        phonemes = self._phonemes
+        return [0] + [phonemes[p] for p in self.alphabet.parse(word)] + [0]
+
+    def _count(self, word, sign):
+        indices = self._indices(word)
+        segments = self.segments
+        natural = self.natural
+        base = len(self.symbols)
+        class_base = len(self.classes) + 1
+        members = self._members
+        for k in range(1, self.n + 1):
+            self._totals[k] += sign * max(0, len(indices) - k + 1)
+            counts = segments[k]
+            class_counts = natural[k]
+            for start in range(len(indices) - k + 1):
+                window = indices[start:start + k]
+                cell = 0
+                for i in window:
+                    cell = cell * base + i
+                counts[cell] += sign
+                for classes in product(*[members[i] for i in window]):
+                    cell = 0
+                    for c in classes:
+                        cell = cell * class_base + c
+                    class_counts[cell] += sign
+        self.words += sign
+
+    def add(self, word):
+        """
+        Count the n-grams of a word.
+
+        Arguments:
+        word : the word
+        """
+        self._count(word, 1)
+
+    def remove(self, word):
+        """
+        Stop counting the n-grams of a word.
+
+        Arguments:
+        word : the word
+        """
+        self._count(word, -1)
+
+    def add_all(self, words):
+        """
+        Count the n-grams of many words.
+
+        Arguments:
+        words : an iterable of words
+        """
+        for word in words:
+            self._count(word, 1)
+
+    def update(self, old_words, new_words):
+        """
+        Replace old words with new ones, only recounting the words that differ.
+
+        Return a dictionary from each segment n-gram of the longest order
+        whose probability changed to a tuple of its old and new probabilities.
+
+        Arguments:
+        old_words : an iterable of the words before a change
+        new_words : an iterable of the same words after the change, in order
+        """
+        changed = [(old, new) for old, new in zip(old_words, new_words)
+                   if old != new]
+        if not changed: return {}
+        counts = self.segments[self.n]
+        total = self.total(self.n)
+        touched = set()
+        for old, new in changed:
+            for word in (old, new):
+                indices = self._indices(word)
+                touched.update(self._cell(indices[i:i + self.n])
+                               for i in range(len(indices) - self.n + 1))
+        before = {cell: counts[cell] for cell in touched}
+        for old, new in changed:
+            self._count(old, -1)
+            self._count(new, 1)
+        new_total = self.total(self.n)
+        # If the number of n-grams changed, so did the probability of every
+        # n-gram counted, not only those in the words that changed
+        cells = before if new_total == total else range(len(counts))
+        effect = {}
+        for cell in cells:
+            count = before.get(cell, counts[cell])
+            if not count and not counts[cell]: continue
+            old_p = count / float(total) if total else 0.0
+            new_p = counts[cell] / float(new_total) if new_total else 0.0
+            if old_p != new_p: effect[self._ngram(cell, self.n)] = (old_p,
+                                                                     new_p)
+        return effect
+
+    def _cell(self, indices):
+        cell = 0
+        for i in indices:
+            cell = cell * len(self.symbols) + i
+        return cell
+
+    def _ngram(self, cell, k):
+        symbols = []
+        for i in range(k):
+            cell, digit = divmod(cell, len(self.symbols))
+            symbols.append(self.symbols[digit])
+        return ''.join(reversed(symbols))
+
+    def _symbol_cell(self, ngram):
+        try: return self._cell([self._index[s] for s in ngram])
+        except KeyError:
+            raise ValueError('%s is not made of symbols of this alphabet' %
+                             ngram)
+
+    def count(self, ngram):
+        """
+        Return the number of times a segment n-gram occurs.
+
+        Arguments:
+        ngram : a string of symbols, where BOUNDARY is a word boundary
+        """
+        if not 0 < len(ngram) <= self.n:
+            raise ValueError('only n-grams of length 1 to %d are counted' %
+                             self.n)
+        return self.segments[len(ngram)][self._symbol_cell(ngram)]
+
+    def class_count(self, classes):
+        """
+        Return the number of times a sequence of natural classes occurs.
+
+        Arguments:
+        classes : a sequence of names of natural classes, where BOUNDARY is
+            a word boundary
+        """
+        if not 0 < len(classes) <= self.n:
+            raise ValueError('only n-grams of length 1 to %d are counted' %
+                             self.n)
+        cell = 0
+        for name in classes:
+            if not name in self._class_index:
+                raise ValueError('no natural class %s' % name)
+            cell = cell * (len(self.classes) + 1) + self._class_index[name]
+        return self.natural[len(classes)][cell]
+
+    def followed(self, ngram):
+        """
+        Return the number of times a segment n-gram occurs followed by another
+        segment, which is the number of times a word-final boundary is not
+        part of it.
+
+        Arguments:
+        ngram : a string of symbols, where BOUNDARY is a word boundary, and
+            shorter than the longest n-grams counted
+        """
+        if not 0 < len(ngram) < self.n:
+            raise ValueError('only n-grams of length 1 to %d are followed' %
+                             (self.n - 1))
+        base = len(self.symbols)
+        start = self._symbol_cell(ngram) * base
+        return sum(self.segments[len(ngram) + 1][start:start + base])
+
+    def total(self, k):
+        """
+        Return the number of n-grams of a given length counted.
+
+        Arguments:
+        k : the length
+        """
+        return self._totals[k]
+
+    def probability(self, ngram):
+        """
+        Return the probability of a segment n-gram among those of its length.
+
+        Arguments:
+        ngram : a string of symbols, where BOUNDARY is a word boundary
+        """
+        total = self.total(len(ngram))
+        if not total: return 0.0
+        return self.count(ngram) / float(total)
+
+    def conditional(self, ngram):
+        """
+        Return the probability of an n-gram's last segment given the others.
+
+        Arguments:
+        ngram : a string of symbols, where BOUNDARY is a word boundary
+        """
+        if len(ngram) == 1: return self.probability(ngram)
+        context = self.followed(ngram[:-1])
+        if not context: return 0.0
+        return self.count(ngram) / float(context)
+
+    def log_probability(self, word):
+        """
+        Return the natural log of a word's probability under the n-gram model,
+        or -inf if the word contains an unseen n-gram.
+
+        Arguments:
+        word : the word
+        """
+        padded = BOUNDARY + word + BOUNDARY
+        total = 0.0
+        for end in range(2, len(padded) + 1):
+            p = self.conditional(padded[max(0, end - self.n):end])
+            if not p: return float('-inf')
+            total += math.log(p)
+        return total
+
+# For testing
+
+def check(ngrams):
+    """
+    Check that the conditional probabilities of the segments following every
+    context that occurs sum to 1, and raise AssertionError if they do not.
+
+    Arguments:
+    ngrams : the Ngrams to check
+    """
+    for k in range(1, ngrams.n):
+        for context in product(ngrams.symbols, repeat=k):
+            context = ''.join(context)
+            if not ngrams.followed(context): continue
+            total = sum(ngrams.conditional(context + s)
+                        for s in ngrams.symbols)
+            assert abs(total - 1) < 1e-9, (context, total)
@@ -1,13 +1,31 @@
 #! /usr/bin/env python
 
+from array import array
+
 from FeatureGeometry import FeatureGeometry
 from FeatureGeometry import features as fg
+from FeatureRegistry import registry
+
+class SegmentError(ValueError):
+    """
+    An error in building a segment. A bulk constructor reports every problem
+    it finds at once, as a list of messages in errors.
+    """
+    def __init__(self, message, errors=()):
+        ValueError.__init__(self, message)
+        self.errors = list(errors)
 
 class Segment:
     """
     A Segment is a mapping of features to values. No feature may have more than
     one value; however, a feature may be unspecified.
+
+    A Segment may also contain other segments, as a word contains phonemes.
+    Every traversal of the nesting is iterative, so it is linear in the size of
+    the whole tree and does not overflow the stack however deep it is.
     """
+    __slots__ = ('geometry', 'features', 'segments')
+
     def __init__(self, geometry=None, features={}, segments=[]):
         self.geometry = geometry
         self.segments = []
@@ -18,12 +36,17 @@ class Segment:
             self.add_feature(f, features[f])
 
     def __eq__(self, other):
-        try:
-            return (other.features == self.features and
-                    other.segments == self.segments and
-                    other.geometry == self.geometry)
-        except AttributeError:
-            return False
+        pairs = [(self, other)]
+        while pairs:
+            a, b = pairs.pop()
+            try:
+                if (a.features != b.features or a.geometry != b.geometry or
+                    len(a.segments) != len(b.segments)):
+                    return False
+            except AttributeError:
+                return False
+            pairs.extend(zip(a.segments, b.segments))
+        return True
 
     def __hash__(self):
         return hash(tuple(self.features.items()))
@@ -36,28 +59,40 @@ class Segment:
 
     def __str__(self, indent=0):
         s = []
-        for f in self.features:
-            s.append('%s[%s %s]' % (' ' * indent, f, self.features[f]))
-        s = '\n'.join(s)
-        i = 0
-        for seg in self.segments:
-            s += '\n%sSegment %s:' % (' ' * indent, i)
-            s += '\n%s' % seg.__str__(indent + 1)
-            i += 1
-        return s
+        stack = [(self, indent)]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, str):
+                s.append(item)
+                continue
+            segment, indent = item
+            s.append('\n'.join('%s[%s %s]' % (' ' * indent, f, v)
+                               for f, v in segment.features.items()))
+            for i in range(len(segment.segments) - 1, -1, -1):
+                stack.append((segment.segments[i], indent + 1))
+                stack.append('\n%sSegment %s:\n' % (' ' * indent, i))
+        return ''.join(s)
+
+    def __iter__(self):
+        """Iterate over this segment and every segment in it, in preorder."""
+        stack = [self]
+        while stack:
+            segment = stack.pop()
+            yield segment
+            stack.extend(reversed(segment.segments))
 
     def add_feature(self, feature, value):
         if not feature in self.geometry:
-            raise StandardError('Illegal feature [%s]' % feature)
+            raise SegmentError('Illegal feature [%s]' % feature)
         if not value in self.geometry[feature].values:
-            raise StandardError("Illegal value '%s'" % value)
+            raise SegmentError("Illegal value '%s'" % value)
         self.features.update({feature: value})
 
     def add_segment(self, segment, index):
         if segment.geometry != self.geometry:
             if self.geometry is None: self.geometry = segment.geometry
-            else: raise StandardError('Different geometries are incompatible')
-        self.segments[index:index] = [segment]
+            else: raise SegmentError('Different geometries are incompatible')
+        self.segments.insert(index, segment)
 
     def add(self, features={}, segments=[], index=None):
         """
@@ -73,6 +108,307 @@ class Segment:
         if index is None: index = len(self.segments)
         self.add_segment(segment, index)
 
+    @classmethod
+    def _make(cls, geometry, features):
+        """Make a segment from features that are already validated."""
+        segment = cls.__new__(cls)
+        segment.geometry = geometry
+        segment.features = features
+        segment.segments = []
+        return segment
+
+    @classmethod
+    def from_bundles(cls, geometry, bundles):
+        """
+        Build a word from many mappings of features to values at once.
+
+        Every bundle is checked against the geometry's table of legal
+        features and values, which is compiled once, and every error is
+        reported together in a single SegmentError.
+
+        Return a segment containing one segment per bundle.
+
+        Arguments:
+        geometry : the FeatureGeometry of the segments
+        bundles : an iterable of mappings from features to values
+        """
+        legal = geometry.legal()
+        make = cls._make
+        segments = []
+        errors = []
+        for i, bundle in enumerate(bundles):
+            features = dict(bundle)
+            if not legal.issuperset(features.items()):
+                for feature, value in features.items():
+                    if not (feature, value) in legal:
+                        errors.append(_illegal(geometry, i, feature, value))
+            segments.append(make(geometry, features))
+        if errors:
+            raise SegmentError('%d illegal features or values' % len(errors),
+                               errors)
+        word = cls._make(geometry, {})
+        word.segments = segments
+        return word
+
+    @classmethod
+    def from_rows(cls, geometry, columns, rows, unspecified=('', None)):
+        """
+        Build a word from the rows of a matrix of feature values at once.
+
+        Each column is validated as a whole against the geometry's values
+        for its feature, so valid input costs one set difference per column,
+        and every error is reported together in a single SegmentError.
+
+        Return a segment containing one segment per row.
+
+        Arguments:
+        geometry : the FeatureGeometry of the segments
+        columns : a list of the features of the columns
+        rows : an iterable of sequences of values, one per column
+        Optional arguments:
+        unspecified : the values that mean a feature is unspecified
+        """
+        rows = [tuple(row) for row in rows]
+        unspecified = frozenset(unspecified)
+        values = geometry.values()
+        errors = []
+        for i, row in enumerate(rows):
+            if len(row) != len(columns):
+                errors.append('row %d: expected %d values, not %d' %
+                              (i, len(columns), len(row)))
+        malformed = len(errors)
+        # The columns are still checked on the well-formed rows, so that
+        # every error is reported at once
+        checked = ([(i, row) for i, row in enumerate(rows)
+                    if len(row) == len(columns)] if malformed
+                   else list(enumerate(rows)))
+        for j, feature in enumerate(columns):
+            column = set(row[j] for i, row in checked) - unspecified
+            if not feature in values:
+                if column:
+                    errors.append('column %d: Illegal feature [%s]' %
+                                  (j, feature))
+                continue
+            bad = column - values[feature]
+            for i, row in (checked if bad else ()):
+                if row[j] in bad:
+                    errors.append(_illegal(geometry, i, feature, row[j]))
+        if errors:
+            message = []
+            if malformed:
+                message.append('%d malformed rows' % malformed)
+            if len(errors) > malformed:
+                message.append('%d illegal features or values' %
+                               (len(errors) - malformed))
+            raise SegmentError(' and '.join(message), errors)
+        make = cls._make
+        word = make(geometry, {})
+        if unspecified.isdisjoint(v for row in rows for v in row):
+            word.segments = [make(geometry, dict(zip(columns, row)))
+                             for row in rows]
+        else:
+            word.segments = [make(geometry,
+                                  {f: v for f, v in zip(columns, row)
+                                   if not v in unspecified})
+                             for row in rows]
+        return word
+
+    def flatten(self):
+        """Return a SegmentArray of this segment and every segment in it."""
+        return SegmentArray.from_segment(self)
+
+def _illegal(geometry, index, feature, value):
+    if not feature in geometry:
+        return 'row %d: Illegal feature [%s]' % (index, feature)
+    return "row %d: Illegal value '%s' for [%s]" % (index, value, feature)
+
+class SegmentArray:
+    """
+    A SegmentArray is a nested Segment stored flat, for holding many of them.
+
+    The segments are stored in preorder. For each one, the array keeps the
+    index of its packed features and the offset back to its parent, which is
+    0 for the root. Segment 0 is the root.
+
+    Features are packed into the shared registry's bits and masks, and each
+    distinct bundle is kept once, so a segment costs two array entries however
+    many features it has. Mappings from features to values are only built
+    when they are read.
+    """
+    __slots__ = ('geometry', 'rows', 'parents', '_bundles', '_index')
+
+    def __init__(self, geometry=None, features=(), parents=()):
+        """
+        Create a new segment array.
+
+        Optional arguments:
+        geometry : the FeatureGeometry of every segment
+        features : a list of mappings from features to values, in preorder
+        parents : a list of offsets back to each segment's parent
+        """
+        self.geometry = geometry
+        self.rows = array('L')
+        self.parents = array('L', parents)
+        self._bundles = []
+        self._index = {}
+        for bundle in features:
+            self.rows.append(self._row(self._pack(bundle)))
+
+    def _pack(self, bundle):
+        """Pack a mapping from features to values, checking it if possible."""
+        if self.geometry is None: return registry.pack(bundle)
+        return self.geometry.pack(bundle)
+
+    def _row(self, packed):
+        """Return the index of a packed bundle, adding it if it is new."""
+        row = self._index.get(packed)
+        if row is None:
+            row = self._index[packed] = len(self._bundles)
+            self._bundles.append(packed)
+        return row
+
+    @classmethod
+    def from_segment(cls, segment):
+        """
+        Flatten a segment and every segment in it.
+
+        Arguments:
+        segment : the root segment
+        """
+        flat = cls(segment.geometry)
+        pack = registry.pack
+        stack = [(segment, 0)]
+        while stack:
+            segment, parent = stack.pop()
+            index = len(flat.rows)
+            # The segment's features were checked when they were added
+            flat.rows.append(flat._row(pack(segment.features)))
+            flat.parents.append(index - parent)
+            stack.extend((s, index) for s in reversed(segment.segments))
+        return flat
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __eq__(self, other):
+        if not isinstance(other, SegmentArray): return False
+        return (self.geometry == other.geometry and
+                self.parents == other.parents and
+                [self._bundles[r] for r in self.rows] ==
+                [other._bundles[r] for r in other.rows])
+
+    def features(self, index):
+        """
+        Return a new mapping from features to values of a segment.
+
+        Arguments:
+        index : the index of the segment
+        """
+        return registry.unpack(*self._bundles[self.rows[index]])
+
+    def packed(self, index):
+        """
+        Return a tuple of the bits and the mask of a segment's features.
+
+        Arguments:
+        index : the index of the segment
+        """
+        return self._bundles[self.rows[index]]
+
+    def parent(self, index):
+        """
+        Return the index of a segment's parent, or None for the root.
+
+        Arguments:
+        index : the index of the segment
+        """
+        if index == 0: return None
+        return index - self.parents[index]
+
+    def depths(self):
+        """Return a list of the depth of every segment, 0 for the root."""
+        depths = [0] * len(self.parents)
+        for i in range(1, len(self.parents)):
+            depths[i] = depths[i - self.parents[i]] + 1
+        return depths
+
+    def children(self, index):
+        """
+        Return a list of the indices of a segment's children, in order.
+
+        Arguments:
+        index : the index of the segment
+        """
+        return [i for i in range(index + 1, self._end(index))
+                if i - self.parents[i] == index]
+
+    def _end(self, index):
+        """
+        Return the index after the last descendant of a segment.
+
+        In preorder, a segment's descendants directly follow it, and each of
+        them has a parent no earlier than the segment.
+        """
+        end = index + 1
+        while end < len(self.parents) and end - self.parents[end] >= index:
+            end += 1
+        return end
+
+    def insert(self, parent, position, features):
+        """
+        Insert a new segment with no children under a parent.
+
+        Return the index of the new segment.
+
+        Arguments:
+        parent : the index of the parent
+        position : the position of the new segment among the parent's children
+        features : a mapping from features to values
+        """
+        row = self._row(self._pack(features))
+        children = self.children(parent)
+        if position < len(children): index = children[position]
+        else: index = self._end(parent)
+        for i in range(index, len(self.parents)):
+            if i - self.parents[i] >= index: continue
+            self.parents[i] += 1
+        self.rows.insert(index, row)
+        self.parents.insert(index, index - parent)
+        return index
+
+    def to_segment(self):
+        """Return this array as a nested Segment."""
+        bundles = self._unpacked()
+        segments = []
+        for i, row in enumerate(self.rows):
+            segment = Segment.__new__(Segment)
+            segment.geometry = self.geometry
+            segment.features = dict(bundles[row])
+            segment.segments = []
+            if i: segments[i - self.parents[i]].segments.append(segment)
+            segments.append(segment)
+        return segments[0]
+
+    def _unpacked(self):
+        """Return the features of every distinct bundle, unpacked once."""
+        return [registry.unpack(bits, mask) for bits, mask in self._bundles]
+
+    def __str__(self):
+        s = []
+        depths = self.depths()
+        bundles = self._unpacked()
+        counts = [0] * len(self.rows)
+        for i, row in enumerate(self.rows):
+            indent = depths[i]
+            if i:
+                parent = i - self.parents[i]
+                s.append('\n%sSegment %s:\n' % (' ' * (indent - 1),
+                                                counts[parent]))
+                counts[parent] += 1
+            s.append('\n'.join('%s[%s %s]' % (' ' * indent, f, v)
+                               for f, v in bundles[row].items()))
+        return ''.join(s)
+
 p = Segment(fg, {'voice':'-', 'place':'lab'})
 b = Segment(fg, {'voice':'+', 'place':'lab'})
 m = Segment(fg, {'voice':'+', 'place':'lab', 'nasal':'+'})
@@ -126,8 +462,8 @@ class Alphabet:
             if char in self.symbols:
                 features.append(self.symbols[char])
             else:
-                raise StandardError('The symbol <%s> is not part of this '
-                                    'alphabet' % char)
+                raise ValueError('The symbol <%s> is not part of this '
+                                 'alphabet' % char)
         return features
 
     def symbolize(self, phonemes):
@@ -0,0 +1,262 @@
+#! /usr/bin/env python
+
+"""
+A long-running local server that keeps one session warm for many clients.
+
+Clients connect over a Unix socket or a localhost TCP port and send one line
+per request. Each request gets back one line of JSON:
+    {"ok": <Boolean>, "result": <value>, "output": <String>}
+
+These requests are reads:
+    class <features> :
+        the sorted symbols whose phonemes have all of the given features
+    symbolize <features> :
+        the sorted symbols whose phonemes are exactly the given features
+    check <features> :
+        whether the given features follow the constraints, and the features
+        they imply, as a string
+    symbols :
+        a dictionary from every symbol to its phoneme, as a string
+    constraints :
+        a list of every constraint, as a string
+
+<features> is a list of signed features and phonemes in slashes, as in the
+REPL, e.g. '+voice -nasal' or '/t/ +voice'.
+
+A line whose first word is followed by '=' or ':', such as 'symbols = +voice',
+is grammar, not a read. Any other line is a write: it is run as a REPL line (a
+grammar line or a command such as 'load' or 'rollback'), and its output is
+returned. Writes are run one at a time in a worker thread. Reads are answered
+from an immutable view of the session that is replaced after each write, so
+they never wait for a write and never see one half done. A write is not ok if
+it raised an exception or wrote anything but warnings to standard error.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import sys
+import threading
+
+import pyre
+from FeatureRegistry import registry, PLUS, MINUS
+
+class View:
+    """
+    An immutable copy of the symbols and constraints at one moment.
+    """
+
+    def __init__(self, symbols, constraints):
+        """
+        Copy the symbols and constraints.
+
+        Arguments:
+        symbols : a dictionary from symbols to phonemes
+        constraints : a dictionary from antecedent phonemes to consequents
+        """
+        self.symbols = {s: p.copy() for s, p in symbols.items()}
+        self.constraints = {a.copy(): c.copy()
+                            for a, c in constraints.items()}
+
+    def features(self, words):
+        """
+        Parse signed features and phonemes in slashes into a phoneme.
+
+        Arguments:
+        words : a list of strings such as '+voice', '-nasal', or '/t/'
+        """
+        phoneme = pyre.Phoneme()
+        for word in words:
+            if len(word) > 2 and word[0] == word[-1] == '/':
+                if not word[1:-1] in self.symbols:
+                    raise ValueError('no such phoneme %s' % word)
+                phoneme.overwrite(self.symbols[word[1:-1]])
+            elif len(word) > 1 and word[0] in '+-':
+                # Reads must not add features or values to the shared
+                # registry
+                name = word[1:]
+                value = PLUS if word[0] == '+' else MINUS
+                if not (name in registry and
+                        value in registry.field(name).codes):
+                    raise ValueError('no such feature %s' % word)
+                phoneme.overwritei({word[1:]: word[0] == '+'})
+            else:
+                raise ValueError('expected a feature, not %s' % word)
+        return phoneme
+
+    def natural_class(self, words):
+        phoneme = self.features(words)
+        return sorted(s for s, p in self.symbols.items() if phoneme <= p)
+
+    def symbolize(self, words):
+        phoneme = self.features(words)
+        return sorted(s for s, p in self.symbols.items() if phoneme == p)
+
+    def check(self, words):
+        phoneme = self.features(words)
+        return [phoneme.follows_constraints(self.constraints), str(phoneme)]
+
+    def list_symbols(self):
+        return {s: str(p) for s, p in self.symbols.items()}
+
+    def list_constraints(self):
+        return ['%s => %s' % item for item in self.constraints.items()]
+
+    reads = {
+        'class': natural_class,
+        'symbolize': symbolize,
+        'check': check,
+        'symbols': lambda self, words: self.list_symbols(),
+        'constraints': lambda self, words: self.list_constraints(),
+    }
+
+# What the current thread is capturing, if anything
+_captured = threading.local()
+
+class _Capture:
+    """
+    A stream that sends what a thread writes to the thread's capture, if it
+    has one, and otherwise to the stream it replaced.
+
+    The streams are replaced once and for all, rather than around each write,
+    so output from other threads never ends up in a write's response.
+    """
+
+    def __init__(self, stream, errors):
+        self._stream = stream
+        self._errors = errors
+
+    def write(self, text):
+        output = getattr(_captured, 'output', None)
+        if output is None: return self._stream.write(text)
+        if self._errors and text.strip() and not text.startswith('Warning'):
+            _captured.failed = True
+        return output.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+def _capture_streams():
+    if not isinstance(sys.stdout, _Capture):
+        sys.stdout = _Capture(sys.stdout, False)
+    if not isinstance(sys.stderr, _Capture):
+        sys.stderr = _Capture(sys.stderr, True)
+
+def run(line):
+    """
+    Run a REPL line against the session.
+
+    Return its output and whether it succeeded, which it did unless it wrote
+    anything but warnings to standard error.
+
+    Arguments:
+    line : the line to run
+    """
+    _capture_streams()
+    _captured.output = io.StringIO()
+    _captured.failed = False
+    try:
+        if not pyre.run_command(line):
+            pyre.parse(line)
+        return _captured.output.getvalue(), not _captured.failed
+    finally:
+        _captured.output = None
+
+def write(line):
+    """
+    Run a REPL line against the session.
+
+    Return its output, whether it succeeded, and a new view.
+
+    Arguments:
+    line : the line to run
+    """
+    output, ok = run(line)
+    return output, ok, View(pyre.symbols, pyre.constraints)
+
+class Server:
+    def __init__(self):
+        self.view = View(pyre.symbols, pyre.constraints)
+        self._lock = asyncio.Lock()
+
+    async def request(self, line):
+        """
+        Answer one request line and return the response as a dictionary.
+
+        Arguments:
+        line : the request, without its line ending
+        """
+        words = line.split()
+        if not words:
+            return {'ok': False, 'result': None, 'output': 'empty request'}
+        # Lines are told from grammar as the REPL tells commands from it, so
+        # 'symbols = +voice' is a write
+        if pyre.command_words(line) and words[0] in View.reads:
+            view = self.view
+            try:
+                result = View.reads[words[0]](view, words[1:])
+            except ValueError as e:
+                return {'ok': False, 'result': None, 'output': str(e)}
+            return {'ok': True, 'result': result, 'output': ''}
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            try:
+                output, ok, self.view = await loop.run_in_executor(None,
+                                                                   write, line)
+            except Exception as e:
+                # The line may have changed the session before it failed
+                self.view = View(pyre.symbols, pyre.constraints)
+                return {'ok': False, 'result': None,
+                        'output': 'Error: %s\n' % e}
+        return {'ok': ok, 'result': None, 'output': output}
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line: break
+                response = await self.request(line.decode('utf-8').strip())
+                writer.write(json.dumps(response).encode('utf-8') + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, path=None, port=None):
+        """
+        Serve clients until cancelled.
+
+        Optional arguments:
+        path : the path of a Unix socket to listen on
+        port : a localhost TCP port to listen on, if there is no path
+        """
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handle, path)
+        else:
+            server = await asyncio.start_server(self.handle, '127.0.0.1',
+                                                port)
+        async with server:
+            await server.serve_forever()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve a pyre session.')
+    parser.add_argument('grammars', nargs='*',
+                        help='files of REPL lines to run before serving')
+    parser.add_argument('--socket', help='the path of a Unix socket')
+    parser.add_argument('--port', type=int, default=8642,
+                        help='a localhost TCP port (default: %(default)s)')
+    args = parser.parse_args(argv)
+    for grammar in args.grammars:
+        with open(grammar) as f:
+            for line in f:
+                line = line.strip()
+                if line: run(line)
+    try:
+        asyncio.run(Server().serve(args.socket, args.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,367 @@
+#! /usr/bin/env python
+
+"""
+Sound changes, and a driver that applies them to a lexicon in parallel.
+
+A word is a string of single-character symbols from an inventory, which is a
+dictionary from symbols to phonemes (as in pyre.symbols). A dialect is a name
+and a list of sound changes, applied in order. Every dialect and every shard of
+the lexicon is independent, so simulate() fans them out to a process pool.
+
+Before any work is sent out, each sound change is compiled against the
+inventory and constraints into plain tables of symbols, so the workers never
+touch phonemes. The tables are given to each worker once, when it starts; on
+platforms that fork, they are simply inherited.
+
+An Evolution applies sound changes to an Alphabet's words generation after
+generation, streaming each generation and checkpointing to disk as it goes.
+"""
+
+import concurrent.futures
+import itertools
+import multiprocessing
+import os
+
+BOUNDARY = '#'
+
+class SoundChange:
+    """
+    A sound change target -> change / before _ after.
+
+    Every phoneme with all the features of the target, whose neighbours have
+    all the features of the environment, gets the features of the change. A
+    side of the environment may be None, for any neighbour or none, or
+    BOUNDARY, for the edge of the word. All the phonemes of a word change at
+    once, so the environment is always matched against the old word.
+    """
+
+    def __init__(self, target, change, before=None, after=None):
+        """
+        Create a new sound change.
+
+        Arguments:
+        target : the phoneme whose features a changing phoneme must have
+        change : the phoneme whose features are added
+        Optional arguments:
+        before : the phoneme before a changing phoneme, or BOUNDARY
+        after : the phoneme after a changing phoneme, or BOUNDARY
+        """
+        self.target = target
+        self.change = change
+        self.before = before
+        self.after = after
+
+    def __repr__(self):
+        return 'SoundChange(%s, %s, %s, %s)' % (self.target, self.change,
+                                                self.before, self.after)
+
+    def __str__(self):
+        before = '' if self.before is None else '%s ' % self.before
+        after = '' if self.after is None else ' %s' % self.after
+        return '%s > %s / %s_%s' % (self.target, self.change, before, after)
+
+    def compile(self, inventory, constraints=None, placeholder='*'):
+        """
+        Compile this sound change into tables of symbols.
+
+        Return a tuple of a dictionary from each changing symbol to its
+        result, and the set of symbols allowed before and after it (None for
+        any symbol or none). BOUNDARY stands for the edge of the word.
+
+        A phoneme that would violate the constraints by changing does not
+        change. A phoneme that changes into something not in the inventory
+        becomes the placeholder.
+
+        Arguments:
+        inventory : a dictionary from symbols to phonemes
+        Optional arguments:
+        constraints : a dictionary of constraints instead of pyre's
+        placeholder : the symbol for a phoneme not in the inventory
+        """
+        names = {p: s for s, p in inventory.items()}
+        results = {}
+        for symbol, phoneme in inventory.items():
+            if not self.target <= phoneme: continue
+            new = phoneme.copy().overwrite(self.change)
+            if not new.follows_constraints(constraints): continue
+            result = names.get(new, placeholder)
+            if result != symbol: results[symbol] = result
+        return (results, _environment(self.before, inventory),
+                _environment(self.after, inventory))
+
+def _environment(phoneme, inventory):
+    if phoneme is None: return None
+    if phoneme == BOUNDARY: return frozenset(BOUNDARY)
+    return frozenset(s for s, p in inventory.items() if phoneme <= p)
+
+def compile_changes(changes, inventory, constraints=None, placeholder='*'):
+    """
+    Compile a list of sound changes into a list of tables.
+
+    Arguments:
+    changes : a list of sound changes
+    inventory : a dictionary from symbols to phonemes
+    Optional arguments:
+    constraints : a dictionary of constraints instead of pyre's
+    placeholder : the symbol for a phoneme not in the inventory
+    """
+    return [c.compile(inventory, constraints, placeholder) for c in changes]
+
+def apply_compiled(word, tables):
+    """
+    Apply a list of compiled sound changes to a word.
+
+    Arguments:
+    word : a string of symbols
+    tables : a list of compiled sound changes
+    """
+    for results, before, after in tables:
+        if not any(symbol in results for symbol in word): continue
+        padded = BOUNDARY + word + BOUNDARY
+        new = []
+        for i, symbol in enumerate(word):
+            if (symbol in results and
+                (before is None or padded[i] in before) and
+                (after is None or padded[i + 2] in after)):
+                new.append(results[symbol])
+            else:
+                new.append(symbol)
+        word = ''.join(new)
+    return word
+
+def apply(words, changes, inventory, constraints=None, placeholder='*'):
+    """
+    Apply a list of sound changes to some words, in this process.
+
+    Return a list of the new words.
+
+    Arguments:
+    words : an iterable of strings of symbols
+    changes : a list of sound changes
+    inventory : a dictionary from symbols to phonemes
+    Optional arguments:
+    constraints : a dictionary of constraints instead of pyre's
+    placeholder : the symbol for a phoneme not in the inventory
+    """
+    tables = compile_changes(changes, inventory, constraints, placeholder)
+    return [apply_compiled(word, tables) for word in words]
+
+# Parallel simulation
+
+_dialects = None
+
+def _initialize(dialects):
+    global _dialects
+    _dialects = dialects
+
+def _work(dialect, shard, words):
+    tables = _dialects[dialect]
+    return dialect, shard, [apply_compiled(word, tables) for word in words]
+
+def _shards(lexicon, size):
+    shard = []
+    for word in lexicon:
+        shard.append(word)
+        if len(shard) == size:
+            yield shard
+            shard = []
+    if shard: yield shard
+
+def simulate(lexicon, dialects, inventory, constraints=None, workers=None,
+             shard_size=1000, placeholder='*'):
+    """
+    Apply each dialect's sound changes to the lexicon in a process pool.
+
+    Yield a tuple of a dialect's name, the number of a shard of the lexicon
+    (counting from 0), and the list of the shard's new words, for every
+    dialect and shard, in the order that they finish.
+
+    Arguments:
+    lexicon : an iterable of strings of symbols
+    dialects : a dictionary from names to lists of sound changes
+    inventory : a dictionary from symbols to phonemes
+    Optional arguments:
+    constraints : a dictionary of constraints instead of pyre's
+    workers : the number of processes; by default, the number of CPUs
+    shard_size : the number of words per task
+    placeholder : the symbol for a phoneme not in the inventory
+    """
+    names = list(dialects)
+    tables = [compile_changes(dialects[name], inventory, constraints,
+                              placeholder) for name in names]
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    else:
+        context = None
+    pool = concurrent.futures.ProcessPoolExecutor(
+        workers, mp_context=context, initializer=_initialize,
+        initargs=(tables,))
+    tasks = ((d, i, shard)
+             for i, shard in enumerate(_shards(lexicon, shard_size))
+             for d in range(len(names)))
+    # Only a few tasks per worker are pending at once, so the lexicon is read
+    # as the results are taken, and stopping early leaves little to finish
+    window = 2 * (workers or os.cpu_count() or 1)
+    pending = set()
+    try:
+        while True:
+            for task in itertools.islice(tasks, window - len(pending)):
+                pending.add(pool.submit(_work, *task))
+            if not pending: break
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                dialect, shard, words = future.result()
+                yield names[dialect], shard, words
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+# Generations
+
+class Evolution:
+    """
+    A lexicon changing over many generations.
+
+    Iterating over an Evolution yields each generation's number and a
+    generator of its words. Only the previous generation is kept in memory
+    while the current one is generated, and every so many generations the
+    lexicon is written to a checkpoint file. An Evolution with an existing
+    checkpoint file starts from it instead of from the original lexicon.
+    """
+
+    def __init__(self, alphabet, changes, lexicon, generations,
+                 constraints=None, checkpoint=None, every=100):
+        """
+        Create a new evolution.
+
+        Arguments:
+        alphabet : the Alphabet of the words
+        changes : a list of sound changes applied in every generation, or a
+            function from a generation's number to such a list
+        lexicon : an iterable of the words of generation 0
+        generations : the number of the last generation
+        Optional arguments:
+        constraints : a dictionary of constraints instead of pyre's
+        checkpoint : the name of the checkpoint file
+        every : the number of generations between checkpoints
+        """
+        self.alphabet = alphabet
+        self.changes = changes
+        self.generations = generations
+        self.constraints = constraints
+        self.checkpoint = checkpoint
+        self.every = every
+        self.generation = 0
+        self._lexicon = lexicon
+        self._tables = None
+        self._resumed = False
+        if checkpoint is not None and os.path.exists(checkpoint):
+            self.generation, self._lexicon = read_checkpoint(checkpoint)
+            self._resumed = True
+
+    def _compile(self, generation):
+        if callable(self.changes): changes = self.changes(generation)
+        elif self._tables is not None: return self._tables
+        else: changes = self.changes
+        tables = compile_changes(changes, self.alphabet.symbols,
+                                 self.constraints, self.alphabet.placeholder)
+        if not callable(self.changes): self._tables = tables
+        return tables
+
+    def _first(self):
+        for word in self._lexicon:
+            # Words from a checkpoint were made by sound changes, and may hold
+            # placeholders for phonemes not in the alphabet
+            if not self._resumed: self.alphabet.parse(word)
+            self._current.append(word)
+            yield word
+
+    def _next(self, previous, tables):
+        for word in previous:
+            word = apply_compiled(word, tables)
+            self._current.append(word)
+            yield word
+
+    def __iter__(self):
+        self._current = []
+        words = self._first()
+        yield self.generation, words
+        for word in words: pass
+        while self.generation < self.generations:
+            previous = self._current
+            self._current = []
+            self.generation += 1
+            words = self._next(previous, self._compile(self.generation))
+            yield self.generation, words
+            for word in words: pass
+            if (self.checkpoint is not None and
+                (self.generation % self.every == 0 or
+                 self.generation == self.generations)):
+                write_checkpoint(self.checkpoint, self.generation,
+                                 self._current)
+
+    def run(self):
+        """Run every remaining generation and return the last lexicon."""
+        for generation, words in self:
+            for word in words: pass
+        return self._current
+
+def write_checkpoint(filename, generation, words):
+    """
+    Write a generation's words to a checkpoint file, replacing it atomically.
+
+    Arguments:
+    filename : the name of the checkpoint file
+    generation : the number of the generation
+    words : a list of the generation's words
+    """
+    temporary = '%s.tmp' % filename
+    with open(temporary, 'w', encoding='utf-8') as f:
+        f.write('generation %d\n' % generation)
+        for word in words:
+            f.write('%s\n' % word)
+    os.replace(temporary, filename)
+
+def read_checkpoint(filename):
+    """
+    Read a checkpoint file and return its generation's number and words.
+
+    Arguments:
+    filename : the name of the checkpoint file
+    """
+    with open(filename, encoding='utf-8') as f:
+        header = f.readline().split()
+        if len(header) != 2 or header[0] != 'generation':
+            raise ValueError('%s is not a checkpoint file' % filename)
+        return int(header[1]), [line.rstrip('\n') for line in f]
+
+# For testing
+
+def check_resume(alphabet, changes, lexicon, generations, checkpoint):
+    """
+    Check that an Evolution stopped after its first checkpoint and resumed
+    from it ends with the same lexicon as one run straight through, and
+    raise AssertionError if it does not.
+
+    Arguments:
+    alphabet : the Alphabet of the words
+    changes : a list of sound changes applied in every generation
+    lexicon : a list of the words of generation 0
+    generations : the number of the last generation, at least 2
+    checkpoint : the name of a checkpoint file to use
+    """
+    expected = Evolution(alphabet, changes, lexicon, generations).run()
+    if os.path.exists(checkpoint): os.remove(checkpoint)
+    try:
+        for generation, words in Evolution(alphabet, changes, lexicon,
+                                           generations, checkpoint=checkpoint,
+                                           every=1):
+            for word in words: pass
+            if generation == 2: break
+        resumed = Evolution(alphabet, changes, lexicon, generations,
+                            checkpoint=checkpoint, every=1)
+        assert resumed.generation == 1, resumed.generation
+        result = resumed.run()
+        assert result == expected, (result, expected)
+    finally:
+        if os.path.exists(checkpoint): os.remove(checkpoint)
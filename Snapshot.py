@@ -0,0 +1,299 @@
+#! /usr/bin/env python
+
+"""
+A binary snapshot of a session: the interned feature names, the symbols, the
+constraints, and optionally a feature geometry and a lexicon.
+
+Layout (all integers little-endian):
+    header :
+        magic '<4s' 'PYRE', version '<H', flags '<H', feature count '<I',
+        symbol count '<I', constraint count '<I'
+    feature names : one length-prefixed UTF-8 string per feature
+    symbol names : one length-prefixed UTF-8 string per symbol
+    padding : zero bytes up to a multiple of 8
+    feature matrix :
+        one row of signed bytes per phoneme, one column per feature: +1 for a
+        positive feature, -1 for a negative feature, 0 for an unspecified
+        feature. The symbols come first, followed by each constraint's
+        antecedent and consequent.
+    geometry (if flags & GEOMETRY) :
+        feature count '<I', then for each feature its name, its value count
+        '<I', its values, and the name of its parent ('' for none)
+    lexicon (if flags & LEXICON) :
+        word count '<I', then one length-prefixed string per word
+
+Strings are prefixed by their length in bytes as '<I'. The feature matrix is
+memory-mapped on loading rather than parsed.
+"""
+
+import mmap
+import os
+import struct
+from itertools import compress
+
+from FeatureGeometry import FeatureGeometry
+
+MAGIC = b'PYRE'
+VERSION = 1
+
+GEOMETRY = 1
+LEXICON = 2
+
+_header = struct.Struct('<4sHHIII')
+_count = struct.Struct('<I')
+
+_positive = (0).__lt__
+
+# The number of columns of the feature matrix packed together by packed()
+_chunk = 4
+
+def _pack_chunk(cells, columns):
+    bits = mask = 0
+    for cell, (plus, minus, field) in zip(cells, columns):
+        if cell:
+            bits |= plus if cell < 128 else minus
+            mask |= field
+    return bits, mask
+
+class SnapshotError(ValueError):
+    pass
+
+def _pack_string(string):
+    data = string.encode('utf-8')
+    return _count.pack(len(data)) + data
+
+def _pack_strings(strings):
+    return b''.join(_pack_string(s) for s in strings)
+
+def _unpack_string(buffer, offset):
+    length, = _count.unpack_from(buffer, offset)
+    offset += _count.size + length
+    return bytes(buffer[offset - length:offset]).decode('utf-8'), offset
+
+def _unpack_strings(buffer, offset, count):
+    strings = []
+    for i in range(count):
+        string, offset = _unpack_string(buffer, offset)
+        strings.append(string)
+    return strings, offset
+
+def _row(features, index):
+    """
+    Encode a dictionary from features to Booleans as a row of signed bytes.
+
+    Arguments:
+    features : the dictionary of signed features
+    index : a dictionary from feature names to columns
+    """
+    row = bytearray(len(index))
+    for feature, sign in features.items():
+        row[index[feature]] = 1 if sign else 255
+    return row
+
+def save(filename, symbols, constraints, geometry=None, lexicon=None):
+    """
+    Write a session to a file.
+
+    Arguments:
+    filename : the name of the file to write
+    symbols : a dictionary from symbols to phonemes
+    constraints : a dictionary from antecedent phonemes to consequent phonemes
+    Optional arguments:
+    geometry : a FeatureGeometry
+    lexicon : an iterable of words as strings
+    """
+    names = sorted(symbols)
+    pairs = list(constraints.items())
+    features = set()
+    for phoneme in symbols.values():
+        features.update(phoneme.features)
+    for antecedent, consequent in pairs:
+        features.update(antecedent.features)
+        features.update(consequent.features)
+    features = sorted(features)
+    index = {f: i for i, f in enumerate(features)}
+    flags = 0
+    if geometry is not None: flags |= GEOMETRY
+    if lexicon is not None: flags |= LEXICON
+    data = bytearray(_header.pack(MAGIC, VERSION, flags, len(features),
+                                  len(names), len(pairs)))
+    data += _pack_strings(features)
+    data += _pack_strings(names)
+    data += bytes(-len(data) % 8)
+    for name in names:
+        data += _row(symbols[name].features, index)
+    for antecedent, consequent in pairs:
+        data += _row(antecedent.features, index)
+        data += _row(consequent.features, index)
+    if geometry is not None:
+        nodes = geometry._geometry
+        parents = {id(node): name for name, node in nodes.items()}
+        data += _count.pack(len(nodes))
+        for name in sorted(nodes):
+            node = nodes[name]
+            data += _pack_string(name)
+            data += _count.pack(len(node.values))
+            data += _pack_strings(sorted(node.values))
+            if node.parent is None: data += _pack_string('')
+            else: data += _pack_string(parents[id(node.parent)])
+    if lexicon is not None:
+        words = list(lexicon)
+        data += _count.pack(len(words))
+        data += _pack_strings(words)
+    with open(filename, 'wb') as f:
+        f.write(data)
+
+class Snapshot:
+    """
+    A session loaded from a file.
+
+    The feature matrix is a view into the memory-mapped file, so rows are only
+    decoded when they are asked for. Call close() when done with it.
+    """
+
+    def __init__(self, filename):
+        """
+        Map a snapshot file into memory.
+
+        Arguments:
+        filename : the name of the file to read
+        """
+        with open(filename, 'rb') as f:
+            # An empty file cannot be mapped
+            if os.fstat(f.fileno()).st_size < _header.size:
+                raise SnapshotError('%s is truncated or corrupt' % filename)
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._read()
+        except (struct.error, UnicodeDecodeError):
+            self.close()
+            raise SnapshotError('%s is truncated or corrupt' % filename)
+        except SnapshotError:
+            self.close()
+            raise
+
+    def _read(self):
+        buffer = self._map
+        (magic, version, flags, feature_count, symbol_count,
+         constraint_count) = _header.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise SnapshotError('not a snapshot file')
+        if version != VERSION:
+            raise SnapshotError('unsupported snapshot version %d' % version)
+        offset = _header.size
+        self.features, offset = _unpack_strings(buffer, offset, feature_count)
+        self.symbols, offset = _unpack_strings(buffer, offset, symbol_count)
+        offset += -offset % 8
+        rows = symbol_count + 2 * constraint_count
+        size = rows * feature_count
+        if offset + size > len(buffer):
+            raise SnapshotError('feature matrix is truncated')
+        self._view = memoryview(buffer)
+        self.matrix = self._view[offset:offset + size].cast('b')
+        self.constraint_count = constraint_count
+        offset += size
+        self.geometry = None
+        if flags & GEOMETRY:
+            self.geometry, offset = self._read_geometry(buffer, offset)
+        self.lexicon = None
+        if flags & LEXICON:
+            count, = _count.unpack_from(buffer, offset)
+            self.lexicon, offset = _unpack_strings(buffer,
+                                                   offset + _count.size, count)
+
+    def _read_geometry(self, buffer, offset):
+        geometry = FeatureGeometry()
+        count, = _count.unpack_from(buffer, offset)
+        offset += _count.size
+        parents = {}
+        for i in range(count):
+            name, offset = _unpack_string(buffer, offset)
+            value_count, = _count.unpack_from(buffer, offset)
+            values, offset = _unpack_strings(buffer, offset + _count.size,
+                                             value_count)
+            parents[name], offset = _unpack_string(buffer, offset)
+            geometry.add(name, values)
+        for name, parent in parents.items():
+            if parent: geometry.add_parent(name, parent)
+        return geometry, offset
+
+    def row(self, index):
+        """
+        Decode a row of the feature matrix as a dictionary from features to
+        Booleans.
+
+        Arguments:
+        index : the number of the row
+        """
+        width = len(self.features)
+        cells = self.matrix[index * width:(index + 1) * width]
+        return dict(zip(compress(self.features, cells),
+                        map(_positive, compress(cells, cells))))
+
+    def packed(self, columns):
+        """
+        Yield every row of the feature matrix packed into a tuple of bits and
+        a mask, without decoding it into a dictionary.
+
+        Each row is split into chunks of columns, and the packing of every
+        chunk seen is cached by its bytes, so each row costs a few dictionary
+        lookups however many features it has.
+
+        Arguments:
+        columns : a list with a tuple for each feature, in order, of the bits
+            of its positive value, the bits of its negative value, and its mask
+        """
+        width = len(self.features)
+        chunks = [(start, min(start + _chunk, width), {})
+                  for start in range(0, width, _chunk)]
+        # No view of the matrix is kept between rows, so that close() works
+        # even if this generator is never finished
+        for index in range(len(self.symbols) + 2 * self.constraint_count):
+            row = self.matrix[index * width:(index + 1) * width].tobytes()
+            bits = mask = 0
+            for start, stop, cache in chunks:
+                key = row[start:stop]
+                packed = cache.get(key)
+                if packed is None:
+                    packed = _pack_chunk(key, columns[start:stop])
+                    cache[key] = packed
+                bits |= packed[0]
+                mask |= packed[1]
+            yield bits, mask
+
+    def symbol(self, index):
+        """
+        Return the name and signed features of a symbol.
+
+        Arguments:
+        index : the number of the symbol
+        """
+        return self.symbols[index], self.row(index)
+
+    def constraint(self, index):
+        """
+        Return the signed features of a constraint's antecedent and consequent.
+
+        Arguments:
+        index : the number of the constraint
+        """
+        row = len(self.symbols) + 2 * index
+        return self.row(row), self.row(row + 1)
+
+    def close(self):
+        """Release the feature matrix and unmap the file."""
+        for name in ('matrix', '_view'):
+            view = getattr(self, name, None)
+            if view is not None:
+                view.release()
+                setattr(self, name, None)
+        self._map.close()
+
+def load(filename):
+    """
+    Map a snapshot file into memory and return it as a Snapshot.
+
+    Arguments:
+    filename : the name of the file to read
+    """
+    return Snapshot(filename)
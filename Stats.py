@@ -0,0 +1,112 @@
+#! /usr/bin/env python
+
+"""
+Counters and timers for the hot paths, for finding out where time goes.
+
+Nothing is recorded unless enabled is True. Code being measured tests
+Stats.enabled before doing any work for it, so disabled statistics cost one
+attribute lookup per call.
+
+Statistics kept:
+    counters : a Counter of named events, such as calls and scans
+    timers : a dictionary from names of phases to total seconds
+    productions : a dictionary from grammar productions to [count, seconds]
+    slowest : the slowest input lines, as a heap of (seconds, line)
+"""
+
+import collections
+import heapq
+import time
+
+enabled = False
+
+# The number of slowest lines to keep
+keep = 10
+
+counters = collections.Counter()
+timers = collections.defaultdict(float)
+productions = {}
+slowest = []
+
+clock = time.perf_counter
+
+def reset():
+    """Forget every statistic."""
+    counters.clear()
+    timers.clear()
+    productions.clear()
+    del slowest[:]
+
+def count(name, n=1):
+    """
+    Add to a counter.
+
+    Arguments:
+    name : the name of the counter
+    Optional arguments:
+    n : the amount to add
+    """
+    counters[name] += n
+
+def add_time(name, seconds):
+    """
+    Add to a timer.
+
+    Arguments:
+    name : the name of the timer
+    seconds : the time to add
+    """
+    timers[name] += seconds
+
+def add_production(production, seconds):
+    """
+    Record one reduction by a grammar production.
+
+    Arguments:
+    production : the production as a string
+    seconds : the time spent in its action
+    """
+    record = productions.get(production)
+    if record is None: productions[production] = [1, seconds]
+    else:
+        record[0] += 1
+        record[1] += seconds
+
+def add_line(line, seconds):
+    """
+    Record the time taken by a line of input, keeping the slowest lines.
+
+    Arguments:
+    line : the line
+    seconds : the time it took
+    """
+    if len(slowest) < keep: heapq.heappush(slowest, (seconds, line))
+    elif seconds > slowest[0][0]: heapq.heapreplace(slowest, (seconds, line))
+
+def report():
+    """Return a list of lines summarizing the statistics."""
+    lines = ['Profiling is %s' % ('on' if enabled else 'off')]
+    if timers:
+        lines.append('Time:')
+        for name, seconds in sorted(timers.items(), key=lambda i: -i[1]):
+            lines.append('  %-36s %10.6f s' % (name, seconds))
+    if counters:
+        lines.append('Counts:')
+        for name, n in sorted(counters.items()):
+            lines.append('  %-36s %10d' % (name, n))
+        for scans, calls in (('constraint scans', 'follows_constraints'),
+                             ('constraints scanned by add', 'add_constraint')):
+            if counters[calls]:
+                lines.append('  %-36s %10.1f' %
+                             ('%s per call' % scans,
+                              counters[scans] / float(counters[calls])))
+    if productions:
+        lines.append('Productions:')
+        for production, (n, seconds) in sorted(productions.items(),
+                                               key=lambda i: -i[1][1]):
+            lines.append('  %6d %10.6f s  %s' % (n, seconds, production))
+    if slowest:
+        lines.append('Slowest lines:')
+        for seconds, line in sorted(slowest, reverse=True):
+            lines.append('  %10.6f s  %s' % (seconds, line))
+    return lines
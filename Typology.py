@@ -0,0 +1,236 @@
+#! /usr/bin/env python
+
+"""
+A parallel search over candidate constraint sets, for typology.
+
+Each candidate is a collection of Constraints.Constraint. A candidate is
+consistent if its constraints can all be added to one ConstraintSet, and a
+consistent candidate licenses the inventory of every bundle of feature values
+(one value for each feature of the feature set) that it allows.
+
+The search runs in a process pool and uses what it has learned to skip work:
+    - Inconsistency comes from a conflicting pair of constraints, so every
+      conflicting pair found is remembered, and any later candidate with that
+      pair is rejected without being sent to a worker.
+    - The inventory licensed by a set of constraints is the intersection of
+      the inventories licensed by its parts. Each worker caches the inventory
+      of every constraint and of every prefix of the (sorted) candidates it
+      sees, so candidates that share constraints share the work.
+Inventories are bit masks over the list of every bundle, so intersecting two
+of them is a single integer operation. Bundles are packed with the shared
+feature registry once, so whether a constraint allows one is an integer test.
+"""
+
+import concurrent.futures
+import itertools
+import multiprocessing
+import os
+
+from Constraints import ConstraintError, ConstraintSet
+from FeatureRegistry import registry
+
+def bundles(featureset):
+    """
+    Return a list of every bundle of values of a feature set, as dictionaries.
+
+    Arguments:
+    featureset : a Constraints.FeatureSet
+    """
+    names = list(featureset)
+    return [dict(zip(names, values))
+            for values in itertools.product(*[list(featureset[n])
+                                              for n in names])]
+
+class Result:
+    """
+    The outcome of evaluating one candidate.
+
+    Attributes:
+    index : the position of the candidate in the input
+    constraints : the candidate's constraints
+    consistent : whether the candidate is consistent
+    conflict : a conflicting pair of constraints, if it is inconsistent
+    pruned : whether the candidate was rejected without being evaluated
+    mask : the bit mask of the licensed bundles, if it is consistent
+    """
+
+    def __init__(self, search, index, constraints, consistent, conflict=None,
+                 pruned=False, mask=None):
+        self._search = search
+        self.index = index
+        self.constraints = constraints
+        self.consistent = consistent
+        self.conflict = conflict
+        self.pruned = pruned
+        self.mask = mask
+
+    def __repr__(self):
+        if self.consistent:
+            return 'Result(%d, consistent, %d bundles)' % (self.index,
+                                                           len(self))
+        return 'Result(%d, inconsistent)' % self.index
+
+    def __len__(self):
+        """Return the number of bundles licensed."""
+        if not self.mask: return 0
+        return bin(self.mask).count('1')
+
+    def inventory(self):
+        """Return a list of the bundles licensed, as dictionaries."""
+        if not self.mask: return []
+        return [b for i, b in enumerate(self._search.bundles)
+                if self.mask >> i & 1]
+
+# Workers
+
+_constraints = None
+_index = None
+_masks = None
+_everything = None
+_prefixes = {}
+
+# The number of prefixes a worker remembers before starting afresh
+cache_size = 100000
+
+def _initialize(constraints, universe):
+    global _constraints, _index, _masks, _everything
+    _constraints = constraints
+    _index = {c: i for i, c in enumerate(constraints)}
+    _everything = (1 << len(universe)) - 1
+    _masks = [sum(1 << i for i, bits in enumerate(universe)
+                  if c.allows_bits(bits))
+              for c in constraints]
+    _prefixes.clear()
+
+def _licensed(indices):
+    """Return the mask licensed by a sorted tuple of constraint indices."""
+    end = len(indices)
+    while end and not indices[:end] in _prefixes:
+        end -= 1
+    mask = _prefixes[indices[:end]] if end else _everything
+    for i in range(end, len(indices)):
+        mask &= _masks[indices[i]]
+        if len(_prefixes) >= cache_size: _prefixes.clear()
+        _prefixes[indices[:i + 1]] = mask
+    return mask
+
+def _evaluate(chunk):
+    results = []
+    for position, indices in chunk:
+        constraint_set = ConstraintSet()
+        try:
+            for i in indices:
+                constraint_set.add(_constraints[i])
+        except ConstraintError as e:
+            pair = tuple(sorted(_index[c] for c in e.constraints))
+            results.append((position, False, pair, None))
+            continue
+        results.append((position, True, None, _licensed(indices)))
+    return results
+
+class Search:
+    """
+    A search over candidate constraint sets over one feature set.
+    """
+
+    def __init__(self, featureset, workers=None, chunk_size=100):
+        """
+        Create a new search.
+
+        Arguments:
+        featureset : the Constraints.FeatureSet of the constraints
+        Optional arguments:
+        workers : the number of processes; by default, the number of CPUs
+        chunk_size : the number of candidates sent to a worker at once
+        """
+        self.featureset = featureset
+        self.bundles = bundles(featureset)
+        # The bundles are packed here, so that workers use the same fields as
+        # the constraints even if they do not share this process's registry
+        self._packed = [registry.pack(b)[0] for b in self.bundles]
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.conflicts = set()
+
+    def _intern(self, candidates, constraints, index):
+        for candidate in candidates:
+            indices = set()
+            for constraint in candidate:
+                if not constraint in index:
+                    index[constraint] = len(constraints)
+                    constraints.append(constraint)
+                indices.add(index[constraint])
+            yield tuple(candidate), tuple(sorted(indices))
+
+    def _pruned(self, indices):
+        for pair in itertools.combinations(indices, 2):
+            if pair in self.conflicts: return pair
+        return None
+
+    def run(self, candidates, stop=None):
+        """
+        Evaluate candidates in a process pool.
+
+        Yield a Result for each candidate, in the order they finish. A
+        candidate with a pair of constraints already known to conflict is
+        rejected at once, without going to a worker.
+
+        Arguments:
+        candidates : a list of collections of constraints
+        Optional arguments:
+        stop : a function from a Result to whether to stop the search
+        """
+        constraints = []
+        index = {}
+        interned = list(self._intern(candidates, constraints, index))
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+        else:
+            context = None
+        with concurrent.futures.ProcessPoolExecutor(
+                self.workers, mp_context=context, initializer=_initialize,
+                initargs=(constraints, self._packed)) as pool:
+            workers = self.workers or os.cpu_count() or 1
+            pending = set()
+            position = 0
+            while position < len(interned) or pending:
+                while position < len(interned) and len(pending) < 2 * workers:
+                    chunk = []
+                    while (position < len(interned) and
+                           len(chunk) < self.chunk_size):
+                        members, indices = interned[position]
+                        pair = self._pruned(indices)
+                        if pair is None:
+                            chunk.append((position, indices))
+                        else:
+                            result = self._result(position, members, pair,
+                                                  constraints, pruned=True)
+                            yield result
+                            if stop is not None and stop(result):
+                                self._cancel(pending)
+                                return
+                        position += 1
+                    if chunk: pending.add(pool.submit(_evaluate, chunk))
+                if not pending: continue
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    for i, consistent, pair, mask in future.result():
+                        if pair is not None: self.conflicts.add(pair)
+                        result = self._result(i, interned[i][0], pair,
+                                              constraints, mask=mask)
+                        yield result
+                        if stop is not None and stop(result):
+                            self._cancel(pending)
+                            return
+
+    def _result(self, position, members, pair, constraints, pruned=False,
+                mask=None):
+        if pair is None:
+            return Result(self, position, members, True, mask=mask)
+        conflict = (constraints[pair[0]], constraints[pair[1]])
+        return Result(self, position, members, False, conflict, pruned)
+
+    def _cancel(self, pending):
+        for future in pending:
+            future.cancel()
@@ -3,8 +3,18 @@
 
 import ply.lex as lex
 import ply.yacc as yacc
+import inspect
 import re
 import sys
+from types import MappingProxyType
+
+import Snapshot
+import Stats
+from FeatureRegistry import registry, PLUS, MINUS
+from History import History
+
+try: input = raw_input
+except NameError: pass
 
 # Lexing
 
@@ -67,6 +77,24 @@ lexer = lex.lex(debug=True)
 
 symbols = {}
 
+# Every change to the symbols, the constraints, or a phoneme's features goes
+# through this log so that it can be rolled back to a checkpoint.
+history = History()
+
+def show(value):
+    """
+    Print a value, timing it if statistics are enabled.
+
+    Arguments:
+    value : the value to print
+    """
+    if Stats.enabled:
+        start = Stats.clock()
+        print(value)
+        Stats.add_time('printing', Stats.clock() - start)
+    else:
+        print(value)
+
 class Phoneme:
     """
     A wrapper class for a dictionary from features to Booleans.
@@ -78,7 +106,11 @@ class Phoneme:
 
     The purpose of this wrapper class is to maintain the invariants of
     phonemes, which are specified by constraints.
+
+    The signed features are packed into two integers using the shared feature
+    registry, so every comparison between phonemes is an integer operation.
     """
+    __slots__ = ('_bits', '_mask')
 
     def __init__(self, features=dict(), plus=set(), minus=set()):
         """
@@ -89,13 +121,33 @@ class Phoneme:
         plus : a set of positive features
         minus : a set of negative features
         """
-        self.features = features.copy()
-        self.features.update({f: True for f in plus})
-        self.features.update({f: False for f in minus})
+        features = dict(features)
+        features.update({f: True for f in plus})
+        features.update({f: False for f in minus})
+        self._bits, self._mask = registry.pack_signs(features)
+
+    @property
+    def features(self):
+        """A read-only dictionary from this phoneme's features to Booleans."""
+        return MappingProxyType({f: v == PLUS for f, v in
+                                 registry.unpack(self._bits,
+                                                 self._mask).items()})
+
+    @features.setter
+    def features(self, features):
+        self._bits, self._mask = registry.pack_signs(features)
+
+    @property
+    def _state(self):
+        return self._bits, self._mask
+
+    @_state.setter
+    def _state(self, state):
+        self._bits, self._mask = state
 
     def __repr__(self):
         """Return a formal representation of this phoneme as a string."""
-        return 'Phoneme(%s)' % self.features
+        return 'Phoneme(%s)' % dict(self.features)
     
     def __str__(self):
         """
@@ -105,15 +157,15 @@ class Phoneme:
         appropriate.
         """
         signed_strings = []
-        for key in sorted(self.features.keys()):
-            if self[key]: signed_strings.append('+%s' % key)
+        features = self.features
+        for key in sorted(features.keys()):
+            if features[key]: signed_strings.append('+%s' % key)
             else: signed_strings.append('-%s' % key)
         return '[%s]' % ' '.join(signed_strings)
 
     def __hash__(self):
         """Return a hash code for this phoneme."""
-        return (hash(tuple(self.features.keys())) ^
-                hash(tuple(self.features.values())))
+        return hash(self._bits)
 
     def __eq__(self, other):
         """
@@ -122,9 +174,7 @@ class Phoneme:
         Arguments:
         other : the object to test equality against
         """
-        if not isinstance(other, Phoneme): return False
-        if len(self.features) != len(other.features): return False
-        return self <= other
+        return isinstance(other, Phoneme) and self._bits == other._bits
 
     def __ne__(self, other):
         """
@@ -147,30 +197,18 @@ class Phoneme:
         """
         if not isinstance(other, Phoneme):
             raise TypeError('can only compare to a Phoneme')
-        for feature in self.features.keys():
-            if feature in other.features:
-                if self[feature] != other[feature]:
-                    return False
-            else:
-                return False
-        return True
+        return other._bits & self._mask == self._bits
 
     def __lt__(self, other):
-        return self <= other and len(self.features) != len(other.features)
+        return self <= other and self._bits != other._bits
 
     def __ge__(self, other):
         if not isinstance(other, Phoneme):
             raise TypeError('can only compare to a Phoneme')
-        for feature in other.features.keys():
-            if feature in self.features:
-                if self[feature] != other[feature]:
-                    return False
-            else:
-                return False
-        return True
+        return other <= self
 
     def __gt__(self, other):
-        return other <= self and len(self.features) != len(other.features)
+        return other <= self and self._bits != other._bits
 
     def __getitem__(self, key):
         """
@@ -179,10 +217,9 @@ class Phoneme:
         Arguments:
         key : the feature whose sign is wanted
         """
-        try:
-            return self.features[key]
-        except KeyError:
-            return None
+        value = registry.value(self._bits, key)
+        if value is None: return None
+        return value == PLUS
 
     def contradicts(self, other):
         """
@@ -194,7 +231,8 @@ class Phoneme:
         Arguments:
         other : the phoneme to compare against
         """
-        return self.contradictsi(other.features)
+        mask = self._mask & other._mask
+        return self._bits & mask != other._bits & mask
 
     def contradictsi(self, features):
         """
@@ -206,12 +244,9 @@ class Phoneme:
         Arguments:
         features : the dictionary of signed features
         """
-        for feature in self.features.keys():
-            if feature in features and self[feature] != features[feature]:
-                return True
-        return False
+        return self.contradicts(Phoneme(features))
 
-    def edit(self, other):
+    def edit(self, other, logged=False):
         """
         Add another phoneme's signed features, unless any contradict.
 
@@ -219,10 +254,17 @@ class Phoneme:
 
         Arguments:
         other : the phoneme to get the new signed features from
+        Optional arguments:
+        logged : whether to record the change in the history, which is only
+            needed for phonemes in the symbols or constraints
         """
-        return self.editi(other.features)
+        if self.contradicts(other):
+            sys.stderr.write("Warning: Inconsistent feature update\n")
+        else:
+            self.update(other, logged)
+        return self
 
-    def editi(self, features):
+    def editi(self, features, logged=False):
         """
         Add some signed features, unless any contradict.
 
@@ -230,14 +272,12 @@ class Phoneme:
 
         Arguments:
         features : the dictionary of signed features
+        Optional arguments:
+        logged : whether to record the change in the history
         """
-        if self.contradictsi(features):
-            sys.stderr.write("Warning: Inconsistent feature update\n")
-        else:
-            self.updatei(features)
-        return self
+        return self.edit(Phoneme(features), logged)
 
-    def update(self, other):
+    def update(self, other, logged=False):
         """
         Add another phoneme's signed features, overwriting in case of conflict.
 
@@ -245,10 +285,17 @@ class Phoneme:
 
         Arguments:
         other : the phoneme to get the new signed features from
+        Optional arguments:
+        logged : whether to record the change in the history, which is only
+            needed for phonemes in the symbols or constraints
         """
-        return self.updatei(other.features)
+        new = self.copy().overwrite(other)
+        if new.follows_constraints():
+            if logged: history.setattr(self, '_state', new._state)
+            else: self._state = new._state
+        return self
 
-    def updatei(self, features):
+    def updatei(self, features, logged=False):
         """
         Add some signed features, overwriting in case of conflict.
 
@@ -256,33 +303,71 @@ class Phoneme:
 
         Arguments:
         features : the dictionary of signed features
+        Optional arguments:
+        logged : whether to record the change in the history
+        """
+        return self.update(Phoneme(features), logged)
+
+    def overwrite(self, other):
+        """
+        Add another phoneme's signed features, overwriting in case of conflict,
+        without checking any constraints.
+
+        Return this phoneme.
+
+        Arguments:
+        other : the phoneme to get the new signed features from
         """
-        new = self.copy()
-        new.features.update(features)
-        if new.follows_constraints(): self.features = new.features
+        self._bits = self._bits & ~other._mask | other._bits
+        self._mask |= other._mask
         return self
 
+    def overwritei(self, features):
+        """
+        Add some signed features, overwriting in case of conflict, without
+        checking any constraints.
+
+        Return this phoneme.
+
+        Arguments:
+        features : the dictionary of signed features
+        """
+        return self.overwrite(Phoneme(features))
+
     def copy(self):
         """Return a copy of this phoneme."""
-        return Phoneme(self.features)
+        new = Phoneme.__new__(Phoneme)
+        new._bits = self._bits
+        new._mask = self._mask
+        return new
 
-    def follows_constraints(self):
+    def follows_constraints(self, rules=None):
         """
         Return whether this phoneme's features do not violate any constraints.
 
         As a side effect, update this phoneme with any features implied by
         constraints.
+
+        Optional arguments:
+        rules : a dictionary of constraints to check instead of the global one
         """
-        for constraint in constraints:
+        if rules is None: rules = constraints
+        if not Stats.enabled: return self._follows(rules)
+        Stats.count('follows_constraints')
+        Stats.count('constraint scans', len(rules))
+        start = Stats.clock()
+        try: return self._follows(rules)
+        finally: Stats.add_time('constraint checks', Stats.clock() - start)
+
+    def _follows(self, rules):
+        for constraint, consequent in rules.items():
             if constraint <= self:
-                if self.contradicts(constraints[constraint]):
+                if self.contradicts(consequent):
                     sys.stderr.write('Error: the phoneme %s violates that '
                                      'constraint!\n' % self)
                     return False
                 else:
-                    for feature in constraints[constraint].features:
-                        self.features.update(
-                            {feature: constraints[constraint][feature]})
+                    self.overwrite(consequent)
         return True
 
 def p_error(p):
@@ -302,34 +387,34 @@ def p_line_new_features_ambiguous(p):
     # None : Set(String) Constant Set(String)
     features = {f: True for f in p[1]}
     for symbol in p[3]:
-        if not symbol in symbols: symbols[symbol] = Phoneme()
-        symbols[symbol].editi(features)
-        print('%s = %s' % (symbol, symbols[symbol]))
+        if not symbol in symbols: history.setitem(symbols, symbol, Phoneme())
+        symbols[symbol].editi(features, True)
+        show('%s = %s' % (symbol, symbols[symbol]))
 
 def p_line_new_features(p):
     'line : features COLON new_symbols'
     # None : Phoneme Constant Set(String)
     for symbol in p[3]:
-        if not symbol in symbols: symbols[symbol] = Phoneme()
-        symbols[symbol].edit(p[1])
-        print('%s = %s' % (symbol, symbols[symbol]))
+        if not symbol in symbols: history.setitem(symbols, symbol, Phoneme())
+        symbols[symbol].edit(p[1], True)
+        show('%s = %s' % (symbol, symbols[symbol]))
 
 def p_line_new_phonemes_ambiguous(p):
     'line : new_symbols EQUALS new_symbols'
     # None : Set(String) Constant Set(String)
     features = {f: True for f in p[3]}
     for symbol in p[1]:
-        if not symbol in symbols: symbols[symbol] = Phoneme()
-        symbols[symbol].editi(features)
-        print('%s = %s' % (symbol, symbols[symbol]))
+        if not symbol in symbols: history.setitem(symbols, symbol, Phoneme())
+        symbols[symbol].editi(features, True)
+        show('%s = %s' % (symbol, symbols[symbol]))
 
 def p_line_new_phonemes(p):
     'line : new_symbols EQUALS features'
     # None : Set(String) Constant Phoneme
     for symbol in p[1]:
-        if not symbol in symbols: symbols[symbol] = Phoneme()
-        symbols[symbol].edit(p[3])
-        print('%s = %s' % (symbol, symbols[symbol]))
+        if not symbol in symbols: history.setitem(symbols, symbol, Phoneme())
+        symbols[symbol].edit(p[3], True)
+        show('%s = %s' % (symbol, symbols[symbol]))
 
 def p_new_symbols_base(p):
     'new_symbols : ID'
@@ -412,8 +497,12 @@ def add_constraint(key, value):
     key : the antecedent phoneme
     value : the consequent phoneme
     """
+    if Stats.enabled:
+        Stats.count('add_constraint')
+        Stats.count('constraints scanned by add', len(constraints))
     if not key.contradicts(value):
         worthwhile = True
+        if Stats.enabled: start = Stats.clock()
         for antecedent in constraints.copy():
             consequent = constraints[antecedent]
             #if antecedent <= key and value.contradicts(consequent):
@@ -429,67 +518,331 @@ def add_constraint(key, value):
             if key <= antecedent and consequent <= value:
                 #print('%s <= %s and %s <= %s' %
                 #      (key, antecedent, consequent, value))
-                del constraints[antecedent]
+                history.delitem(constraints, antecedent)
+                if Stats.enabled: Stats.count('redundant constraints pruned')
+        if Stats.enabled:
+            Stats.add_time('constraint pruning', Stats.clock() - start)
         if worthwhile:
-            if key in constraints: constraints[key].edit(value)
-            else: constraints[key] = value
+            if key in constraints: constraints[key].edit(value, True)
+            else: history.setitem(constraints, key, value)
 
 def p_implication_ambiguous_lr(p):
     'line : new_symbols RARR new_symbols'
     # None : Set(String) Constant Set(String)
     add_constraint(Phoneme({f: True for f in p[1]}),
                    Phoneme({f: True for f in p[3]}))
-    print(constraints)
+    show(constraints)
 
 def p_implication_ambiguous_l(p):
     'line : new_symbols RARR features'
     # None : Set(String) Constant Phoneme
     add_constraint(Phoneme({f: True for f in p[1]}), p[3])
-    print(constraints)
+    show(constraints)
 
 def p_implication_ambiguous_r(p):
     'line : features RARR new_symbols'
     # None : Phoneme Constant Set(String)
     add_constraint(p[1], Phoneme({f: True for f in p[3]}))
-    print(constraints)
+    show(constraints)
 
 def p_implication(p):
     'line : features RARR features'
     # None : Phoneme Constant Phoneme
     add_constraint(p[1], p[3])
-    print(constraints)
+    show(constraints)
 
 def p_converse_implication_ambiguous_lr(p):
     'line : new_symbols LARR new_symbols'
     # None : Set(String) Constant Set(String)
     add_constraint(Phoneme({f: True for f in p[3]}),
                    Phoneme({f: True for f in p[1]}))
-    print(constraints)
+    show(constraints)
 
 def p_converse_implication_ambiguous_l(p):
     'line : new_symbols LARR features'
     # None : Set(String) Constant Phoneme
     add_constraint(p[3], Phoneme({f: True for f in p[1]}))
-    print(constraints)
+    show(constraints)
 
 def p_converse_implication_ambiguous_r(p):
     'line : features LARR new_symbols'
     # None : Phoneme Constant Set(String)
     add_constraint(Phoneme({f: True for f in p[3]}), p[1])
-    print(constraints)
+    show(constraints)
 
 def p_converse_implication(p):
     'line : features LARR features'
     # None : Phoneme Constant Phoneme
     add_constraint(p[3], p[1])
-    print(constraints)
+    show(constraints)
+
+# Sessions
+
+def save_session(filename, geometry=None, lexicon=None):
+    """
+    Write the symbols and constraints to a snapshot file.
+
+    Arguments:
+    filename : the name of the file to write
+    Optional arguments:
+    geometry : a FeatureGeometry to save along with the session
+    lexicon : an iterable of words to save along with the session
+    """
+    Snapshot.save(filename, symbols, constraints, geometry, lexicon)
+
+def load_session(filename):
+    """
+    Replace the symbols and constraints with those in a snapshot file.
+
+    Return the snapshot's geometry and lexicon, either of which may be None.
+
+    Arguments:
+    filename : the name of the file to read
+    """
+    snapshot = Snapshot.load(filename)
+    try:
+        # The rows are packed straight into the registry's fields, without
+        # making a dictionary for each one
+        columns = [(registry.code(f, PLUS), registry.code(f, MINUS),
+                    registry.field(f).mask) for f in snapshot.features]
+        phonemes = []
+        for state in snapshot.packed(columns):
+            phoneme = Phoneme.__new__(Phoneme)
+            phoneme._bits, phoneme._mask = state
+            phonemes.append(phoneme)
+    finally:
+        snapshot.close()
+    count = len(snapshot.symbols)
+    new_symbols = dict(zip(snapshot.symbols, phonemes[:count]))
+    new_constraints = dict(zip(phonemes[count::2], phonemes[count + 1::2]))
+    history.replace(symbols, new_symbols)
+    history.replace(constraints, new_constraints)
+    return snapshot.geometry, snapshot.lexicon
+
+# Commands
+
+commands = {}
+
+def command(name):
+    """
+    Register a function as a command, run when a line starts with its name.
+
+    The rest of the words on the line are passed to the function as arguments.
+
+    Arguments:
+    name : the word that invokes the command
+    """
+    def register(function):
+        commands[name] = function
+        return function
+    return register
+
+def command_words(s):
+    """
+    Return the words of a line if it is shaped like a command, or None if it
+    is grammar.
+
+    A line is grammar if its first word is followed by '=' or ':', as in
+    'save = +voice' or 'save: b', so a phoneme or feature may share its name
+    with a command. Otherwise the arguments of a command may contain anything,
+    as in 'load C:\\x.snap'. (A line that defines several phonemes at once
+    can always put one that is not named like a command first.)
+
+    Arguments:
+    s : the input line
+    """
+    words = s.split()
+    if not words or len(words) > 1 and words[1][0] in '=:':
+        return None
+    return words
+
+def run_command(s):
+    """
+    Run a line as a command, if it is one, and return whether it was.
+
+    Arguments:
+    s : the input line
+    """
+    words = command_words(s)
+    if not words or words[0] not in commands:
+        return False
+    function = commands[words[0]]
+    try:
+        inspect.signature(function).bind(*words[1:])
+    except TypeError:
+        sys.stderr.write('Error: Wrong number of arguments to %s\n' %
+                         words[0])
+        return True
+    try:
+        function(*words[1:])
+    except (IOError, OSError, Snapshot.SnapshotError) as e:
+        sys.stderr.write('Error: %s\n' % e)
+    return True
+
+@command('save')
+def save_command(filename):
+    save_session(filename)
+    print('Saved %d symbols and %d constraints to %s' %
+          (len(symbols), len(constraints), filename))
+
+@command('load')
+def load_command(filename):
+    load_session(filename)
+    print('Loaded %d symbols and %d constraints from %s' %
+          (len(symbols), len(constraints), filename))
+
+@command('checkpoint')
+def checkpoint_command(name=None):
+    print('Checkpoint %s' % history.checkpoint(name))
+
+@command('rollback')
+def rollback_command(name=None):
+    try: print('Rolled back to checkpoint %s' % history.rollback(name))
+    except KeyError as e: sys.stderr.write('Error: %s\n' % e.args[0])
+
+@command('diff')
+def diff_command(name=None):
+    try: lines = diff(name)
+    except KeyError as e:
+        sys.stderr.write('Error: %s\n' % e.args[0])
+        return
+    for line in lines: print(line)
+
+def diff(name=None):
+    """
+    Return a list of lines describing the changes to the symbols and
+    constraints since a checkpoint.
+
+    Added entries start with '+', removed entries with '-', and changed
+    symbols with '~'.
+
+    Optional arguments:
+    name : the name of the checkpoint; by default, the latest one
+    """
+    items, attributes = history.originals(name)
+    def old_phoneme(phoneme):
+        key = (id(phoneme), '_state')
+        if not key in attributes: return phoneme
+        old = Phoneme()
+        old._state = attributes[key][2]
+        return old
+    touched = {}
+    for mapping, key, old in items.values():
+        touched[id(mapping), key] = old
+    if attributes:
+        for mapping in (symbols, constraints):
+            for key, value in mapping.items():
+                if (id(value), '_state') in attributes:
+                    touched.setdefault((id(mapping), key), value)
+    lines = []
+    for key in sorted(k for m, k in touched if m == id(symbols)):
+        old = touched[id(symbols), key]
+        if old is History.missing:
+            lines.append('+ %s = %s' % (key, symbols[key]))
+        elif not key in symbols:
+            lines.append('- %s = %s' % (key, old_phoneme(old)))
+        else:
+            before = old_phoneme(old)
+            if before != symbols[key]:
+                lines.append('~ %s = %s -> %s' % (key, before, symbols[key]))
+    for key in [k for m, k in touched if m == id(constraints)]:
+        old = touched[id(constraints), key]
+        if old is not History.missing:
+            before = old_phoneme(old)
+            if key in constraints and before == constraints[key]: continue
+            lines.append('- %s => %s' % (key, before))
+        if key in constraints:
+            lines.append('+ %s => %s' % (key, constraints[key]))
+    return lines
+
+@command('profile')
+def profile_command(state):
+    if state == 'on': profile(True)
+    elif state == 'off': profile(False)
+    else:
+        sys.stderr.write("Error: Expected 'on' or 'off'\n")
+        return
+    print('Profiling is %s' % state)
+
+@command('stats')
+def stats_command(action=None):
+    if action == 'reset':
+        Stats.reset()
+        print('Statistics reset')
+    else:
+        for line in Stats.report(): print(line)
 
 # Running the program
 
 parser = yacc.yacc(start='line')
-while True:
-    try: s = raw_input('> ')
-    except EOFError: break
-    if not s: continue
-    result = parser.parse(s)
-    print(result)
+
+def profile(on):
+    """
+    Turn statistics on or off.
+
+    While statistics are on, every grammar production's action is wrapped to
+    count and time it; while they are off, the actions are left alone.
+
+    Arguments:
+    on : whether to turn statistics on
+    """
+    if on == Stats.enabled: return
+    for production in parser.productions:
+        if production.callable is None: continue
+        if on:
+            production.callable = _timed_action(production.str,
+                                                production.callable)
+        else:
+            production.callable = production.callable.action
+    Stats.enabled = on
+
+def _timed_action(name, action):
+    def timed(p):
+        start = Stats.clock()
+        try: action(p)
+        finally:
+            seconds = Stats.clock() - start
+            Stats.add_production(name, seconds)
+            Stats.add_time('grammar actions', seconds)
+    timed.action = action
+    return timed
+
+def _timed_token():
+    start = Stats.clock()
+    token = lexer.token()
+    Stats.add_time('lexing', Stats.clock() - start)
+    return token
+
+def parse(s):
+    """
+    Parse a line of input, recording statistics if they are enabled.
+
+    Arguments:
+    s : the line
+    """
+    if not Stats.enabled: return parser.parse(s, lexer=lexer)
+    lexing = Stats.timers['lexing']
+    actions = Stats.timers['grammar actions']
+    start = Stats.clock()
+    try: return parser.parse(s, lexer=lexer, tokenfunc=_timed_token)
+    finally:
+        seconds = Stats.clock() - start
+        Stats.count('lines')
+        Stats.add_time('parsing (total)', seconds)
+        # What is left after lexing and the actions is the LALR parser's own
+        Stats.add_time('parsing (LALR only)',
+                       seconds - (Stats.timers['lexing'] - lexing) -
+                       (Stats.timers['grammar actions'] - actions))
+        Stats.add_line(s, seconds)
+
+def main():
+    while True:
+        try: s = input('> ')
+        except EOFError: break
+        if not s: continue
+        if run_command(s): continue
+        result = parse(s)
+        print(result)
+
+if __name__ == '__main__':
+    main()